@@ -0,0 +1,74 @@
+# This file provides helpers shared by the batch system interfaces (sge.py, slurm.py)
+
+from time import time
+
+class QueueHosts(object):
+    """QueueHosts is a snapshot of the hosts which belong to a batch queue.
+    Membership checks (hostname in queueHosts) are set lookups.
+    """
+
+    def __init__(self, hosts, queue=None):
+        self.hosts = frozenset(hosts)
+        self.queue = queue
+        self.time = time()
+
+    def __contains__(self, hostname):
+        return hostname in self.hosts
+
+    def __iter__(self):
+        return iter(self.hosts)
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def age(self):
+        """age of the snapshot in seconds"""
+        return time() - self.time
+
+class QueueHostCache(object):
+    """QueueHostCache keeps one QueueHosts snapshot per queue for ttl seconds.
+    fetch(queue) has to return the hostnames of queue or a QueueHosts snapshot.
+    With ttl 0 every get() fetches a new snapshot.
+    """
+
+    def __init__(self, fetch, ttl=0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.snapshots = {}
+
+    def get(self, queue):
+        snapshot = self.snapshots.get(queue)
+        if snapshot is None or snapshot.age() >= self.ttl:
+            snapshot = self.fetch(queue)
+            if not isinstance(snapshot, QueueHosts):
+                snapshot = QueueHosts(snapshot, queue)
+            self.snapshots[queue] = snapshot
+        return snapshot
+
+    def last(self, queue):
+        """returns the latest snapshot of queue, even if it is older than ttl, or None"""
+        return self.snapshots.get(queue)
+
+    def invalidate(self):
+        """drops all cached snapshots, the next get() fetches again"""
+        self.snapshots = {}
+
+# conservative limit for the arguments of one command line (ARG_MAX is often 128k or more)
+maxArgBytes = 32768
+
+def chunkArgs(args, maxBytes=maxArgBytes):
+    """splits args into lists whose command line length stays below maxBytes"""
+    chunks = []
+    chunk = []
+    size = 0
+    for arg in args:
+        arg = str(arg)
+        if chunk and size + len(arg) + 1 > maxBytes:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(arg)
+        size += len(arg) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
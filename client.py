@@ -1,12 +1,24 @@
 # Python RPC interface for OpenNebula 3.4
 
 import os
+import socket
+import threading
 
+import httplib
 import xmlrpclib
 
-import xml.etree.ElementTree as ET
+from time import time
 
-from operator import itemgetter
+# the C parser is much faster and needs less memory
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
 
 class OneError(Exception):
     def __init__(self, msg, error):
@@ -22,10 +34,99 @@ class OneRPCError(Exception):
         return repr("%s" % (self.msg))
     
 
+class KeepAliveTransport(xmlrpclib.Transport):
+    """KeepAliveTransport keeps HTTP/1.1 connections to the XML RPC server open.
+    Idle connections are kept in a pool of at most poolSize connections, every request
+    takes one out of the pool, so the transport can be shared by concurrent threads.
+    If the server closed a pooled connection, the request is repeated once on a new one.
+    Every socket operation of a request times out after timeout seconds (None: never).
+    """
+
+    def __init__(self, poolSize=4, timeout=None):
+        xmlrpclib.Transport.__init__(self)
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.pool = []
+        self.lock = threading.Lock()
+
+    def request(self, host, handler, request_body, verbose=0):
+        for attempt in (0, 1):
+            connection, reused = self.acquire(host, fresh=(attempt > 0))
+            try:
+                response = self.send(connection, host, handler, request_body, verbose)
+            except xmlrpclib.Fault:
+                self.release(host, connection)
+                raise
+            except socket.timeout:
+                # a hung server is not asked again
+                connection.close()
+                raise
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                if attempt or not reused:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                raise
+            self.release(host, connection)
+            return response
+
+    def send(self, connection, host, handler, request_body, verbose):
+        """sends one request over connection and parses the response"""
+        if verbose:
+            connection.set_debuglevel(1)
+        self.send_request(connection, handler, request_body)
+        self.send_host(connection, host)
+        self.send_user_agent(connection)
+        self.send_content(connection, request_body)
+
+        response = connection.getresponse(buffering=True)
+        if response.status == 200:
+            self.verbose = verbose
+            return self.parse_response(response)
+
+        # discard the response, the connection can be used again
+        response.read()
+        raise xmlrpclib.ProtocolError(host + handler, response.status, response.reason, response.msg)
+
+    def acquire(self, host, fresh=False):
+        """returns (connection, reused), an idle pooled connection or a new one"""
+        if not fresh:
+            with self.lock:
+                for i in range(len(self.pool) - 1, -1, -1):
+                    if self.pool[i][0] == host:
+                        return (self.pool.pop(i)[1], True)
+
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        return (self.make(chost), False)
+
+    def make(self, chost):
+        """creates a new connection to chost"""
+        if self.timeout is None:
+            return httplib.HTTPConnection(chost)
+        return httplib.HTTPConnection(chost, timeout=self.timeout)
+
+    def release(self, host, connection):
+        """puts connection back into the pool or closes it if the pool is full"""
+        with self.lock:
+            if len(self.pool) < self.poolSize:
+                self.pool.append((host, connection))
+                return
+        connection.close()
+
+    def close(self):
+        """closes all idle connections"""
+        with self.lock:
+            pool = self.pool
+            self.pool = []
+        for host, connection in pool:
+            connection.close()
+
 class OneRPC(object):
     defaultAuthFile = "~/.one/one_auth"
 
-    def __init__(self, hostname="localhost", port=2633, auth=None):
+    def __init__(self, hostname="localhost", port=2633, auth=None, connections=4, timeout=None):
         """
         Constructor
         """
@@ -42,21 +143,54 @@ class OneRPC(object):
         #self.auth = "%s:%s" % (user, password)
         self.auth = auth
 
-        uri = "http://%s:%i" % (hostname, port)
-        self.rpc = xmlrpclib.ServerProxy(uri)
+        self.uri = "http://%s:%i" % (hostname, port)
+        # all proxies share the keep-alive connections of one transport
+        self.transport = KeepAliveTransport(poolSize=connections, timeout=timeout)
+        # xmlrpclib proxies must not be shared between threads, see rpc
+        self.local = threading.local()
+        # observer(method, seconds, failed) is called for every XML RPC call, e.g. for metrics
+        self.observer = None
 
         try:
             methods = self.rpc.system.listMethods()
         except Exception, err:
-            raise OneRPCError("Cannot connect to ONE XML RPC server at %s" % uri)
+            raise OneRPCError("Cannot connect to ONE XML RPC server at %s" % self.uri)
 
         if not requiredMethods.issubset(set(methods)):
             raise OneRPCError("XML RPC server does not support required methods.")
 
+        # batches are sent as one request if the server supports system.multicall
+        self.hasMulticall = "system.multicall" in methods
+
+    @property
+    def rpc(self):
+        """ServerProxy of the calling thread, every worker thread gets its own"""
+        try:
+            return self.local.proxy
+        except AttributeError:
+            self.local.proxy = xmlrpclib.ServerProxy(self.uri, transport=self.transport)
+            return self.local.proxy
+
+    def _call(self, method, *args):
+        """calls the XML RPC method with the auth string and args, the call is reported to the observer"""
+        start = time()
+        try:
+            response = reduce(getattr, method.split("."), self.rpc)(self.auth, *args)
+        except Exception:
+            self.observe(method, time() - start, True)
+            raise
+        self.observe(method, time() - start, response[0] == False)
+        return response
+
+    def observe(self, method, seconds, failed):
+        """reports one call of method to the observer, seconds is None for the calls of a multicall"""
+        if self.observer is not None:
+            self.observer(method, seconds, failed)
+
     def hostpoolInfo(self):
         """ get all hosts """
         try:
-            status, msg, error = self.rpc.one.hostpool.info(self.auth)
+            status, msg, error = self._call("one.hostpool.info")
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -71,7 +205,7 @@ class OneRPC(object):
     def hostInfo(self, id):
         """ get host info"""
         try:
-            status, msg, error = self.rpc.one.host.info(self.auth, id)
+            status, msg, error = self._call("one.host.info", id)
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -105,7 +239,7 @@ class OneRPC(object):
 
         try:
             # -2: all vms; -1: start range; -1: end range; -2: vm states;
-            status, msg, error = self.rpc.one.vmpool.info(self.auth, -2, startRange, endRange, stateFilter)
+            status, msg, error = self._call("one.vmpool.info", -2, startRange, endRange, stateFilter)
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -117,11 +251,52 @@ class OneRPC(object):
         else:
             raise OneError(msg, error)
     
+    def vmpoolInfoPaged(self, stateFilter="anyButDone", startRange=0, pageSize=1000, lastID=-1):
+        """ returns a list with all VMs from startRange on, fetched in ID ranges of pageSize.
+        Ranges are closed up to lastID (the highest VM ID known to the caller),
+        VMs above lastID are fetched with one open range.
+        If the caller knows no VM ID from startRange on yet (first cycle), lastID is probed with highestVMID.
+        """
+        vms = []
+        start = startRange
+        if pageSize > 0 and lastID < startRange:
+            lastID = self.highestVMID(startRange)
+        while pageSize > 0 and start + pageSize - 1 <= lastID:
+            vms.extend(self.vmpoolInfo(stateFilter, start, start + pageSize - 1))
+            start += pageSize
+        vms.extend(self.vmpoolInfo(stateFilter, start, -1))
+        return vms
+    
+    def highestVMID(self, startRange=0):
+        """ returns the highest VM ID from startRange on (startRange - 1 if there is none).
+        oned has no ID-only pool query, so the ID is searched with point probes:
+        vmpool.info calls over a single ID (done VMs included) return at most one VM.
+        VM IDs increase, the step is doubled until an ID is missing, then the range is bisected.
+        A purged VM ends the search early, the VMs above are still found by the open range of vmpoolInfoPaged.
+        """
+        def exists(id):
+            return len(self.vmpoolInfo("any", id, id)) > 0
+
+        low = startRange - 1
+        step = 1
+        while exists(low + step):
+            low += step
+            step *= 2
+        # low exists (or is startRange - 1), low + step is missing
+        high = low + step
+        while high - low > 1:
+            middle = (low + high) // 2
+            if exists(middle):
+                low = middle
+            else:
+                high = middle
+        return low
+
     def vmInfo(self, id):
         """ returns VM with specified id """
         try:
             # -2: all vms; -1: start range; -1: end range; -2: vm states;
-            status, msg, error = self.rpc.one.vm.info(self.auth, id)
+            status, msg, error = self._call("one.vm.info", id)
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -147,7 +322,7 @@ class OneRPC(object):
             raise OneError("%s is not a valid action" % action, 1919)
         
         try:
-            status, msg, error = self.rpc.one.vm.action(self.auth, action, vid)
+            status, msg, error = self._call("one.vm.action", action, vid)
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -187,10 +362,91 @@ class OneRPC(object):
         """ vmCancel(vid) cancels VM with vid """
         self.vmAction("cancel", vid)
 
+    def vmActionBatch(self, action, vids):
+        """runs a known VM action for all vids, see vmAction and multicall.
+        Returns a list with one result per vid: None or the OneError/OneRPCError of the call.
+        """
+        knownActions = [
+                "finalize", "restart", "shutdown", "suspend", "hold",
+                "resubmit", "stop", "resume", "release", "cancel", "reboot"
+                ]
+        if not action in knownActions:
+            raise OneError("%s is not a valid action" % action, 1919)
+
+        return self.multicall("one.vm.action", [(action, vid) for vid in vids])
+
+    def vmDeployBatch(self, deployments):
+        """deploys VMs, deployments is a list of (vid, hid) tuples, see vmDeploy and multicall.
+        Returns a list with one result per deployment: None or the OneError/OneRPCError of the call.
+        """
+        return self.multicall("one.vm.deploy", deployments)
+
+    def multicall(self, method, argsList):
+        """calls method once per args tuple in argsList (the auth string is prepended)
+        with a single system.multicall request.
+        Falls back to one request per call if the server does not support system.multicall.
+        Returns a list with one result per call: None or the OneError/OneRPCError of the call.
+        """
+        if len(argsList) == 0:
+            return []
+
+        if not self.hasMulticall:
+            return [self.singlecall(method, args) for args in argsList]
+
+        batch = xmlrpclib.MultiCall(self.rpc)
+        for args in argsList:
+            reduce(getattr, method.split("."), batch)(self.auth, *args)
+
+        start = time()
+        try:
+            responses = batch()
+        except xmlrpclib.Fault, err:
+            self.observe("system.multicall", time() - start, True)
+            return [OneRPCError("XMLRPC fault: %s" % err.faultString)] * len(argsList)
+        except Exception, err:
+            self.observe("system.multicall", time() - start, True)
+            return [OneRPCError("XMLRPC fault: %s" % err)] * len(argsList)
+        self.observe("system.multicall", time() - start, False)
+
+        results = []
+        for i in range(len(argsList)):
+            try:
+                status, msg, error = responses[i]
+            except xmlrpclib.Fault, err:
+                results.append(OneRPCError("XMLRPC fault: %s" % err.faultString))
+                self.observe(method, None, True)
+                continue
+            except Exception, err:
+                results.append(OneRPCError("XMLRPC fault: %s" % err))
+                self.observe(method, None, True)
+                continue
+
+            if status == False:
+                results.append(OneError(msg, error))
+            else:
+                results.append(None)
+            self.observe(method, None, status == False)
+        return results
+
+    def singlecall(self, method, args):
+        """calls method with args (the auth string is prepended) in its own request.
+        Returns None or the OneError/OneRPCError of the call.
+        """
+        try:
+            status, msg, error = self._call(method, *args)
+        except xmlrpclib.Fault, err:
+            return OneRPCError("XMLRPC fault: %s" % err.faultString)
+        except Exception, err:
+            return OneRPCError("XMLRPC fault: %s" % err)
+
+        if status == False:
+            return OneError(msg, error)
+        return None
+
     def vmDeploy(self, vid, hid):
         """ vmDeploy(vid, hid) deploys VM with vid on HOST with hid """
         try:
-            status, msg, error = self.rpc.one.vm.deploy(self.auth, vid, hid)
+            status, msg, error = self._call("one.vm.deploy", vid, hid)
         except xmlrpclib.Fault, err:
             raise OneRPCError("XMLRPC fault: %s" % err.faultString)
         except Exception, err:
@@ -222,6 +478,26 @@ class OneRPC(object):
 
 
 
+def iter_pool(xmlStr, tag):
+    """yields the tag elements below the root of a pool xml string.
+    The string is parsed incrementally and every element and the root are cleared after use,
+    so the complete element tree is never built.
+    Only records directly below the root are yielded, user templates may contain any tag.
+    """
+    context = ET.iterparse(StringIO(xmlStr), events=("start", "end"))
+    event, root = next(context)
+    depth = 1
+    for event, element in context:
+        if event == "start":
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 1 and element.tag == tag:
+            yield element
+            element.clear()
+            root.clear()
+
 def parse_template(template_element):
     template = {}
     if template_element != None:
@@ -235,7 +511,41 @@ def parse_template(template_element):
                     template[name][subsubelement.tag] = subsubelement.text
     return template
 
-class OneHost(object):
+class LazyRecord(object):
+    """LazyRecord is the base of records decoded from OpenNebula xml.
+    Subclasses decode their hot fields in the constructor and list all other fields in
+    lazyFields (attribute: (xml path, conversion or None for the text)).
+    Those are decoded on first access and stored in their slot.
+    """
+    __slots__ = ("_fields",)
+
+    lazyFields = {}
+
+    def __init__(self, xmlElement):
+        # the children are kept, so the element itself can be cleared after construction
+        self._fields = dict((child.tag, child) for child in xmlElement)
+
+    def __getattr__(self, name):
+        try:
+            path, convert = self.lazyFields[name]
+        except KeyError:
+            raise AttributeError(name)
+
+        tag, sep, subtag = path.partition("/")
+        element = self._fields.get(tag)
+        if element is not None and subtag:
+            element = element.find(subtag)
+        if element is None:
+            raise AttributeError(name)
+
+        value = element.text if convert is None else convert(element.text)
+        setattr(self, name, value)
+        return value
+
+class OneHost(LazyRecord):
+    """OneHost represents a opennebula host.
+    id, name and state are decoded in the constructor, all other fields on first access.
+    """
     
     states = {
             0:"init",
@@ -245,34 +555,43 @@ class OneHost(object):
             4:"disabled",
             5:"monitoring_error"
             }
+
+    lazyFields = {
+            "im_mad": ("IM_MAD", None),
+            "vm_mad": ("VM_MAD", None),
+            "vn_mad": ("VN_MAD", None),
+            "last_mon_time": ("LAST_MON_TIME", int),
+            "disk_usage": ("HOST_SHARE/DISK_USAGE", int),
+            "mem_usage": ("HOST_SHARE/MEM_USAGE", int),
+            "cpu_usage": ("HOST_SHARE/CPU_USAGE", int),
+            "max_disk": ("HOST_SHARE/MAX_DISK", int),
+            "max_mem": ("HOST_SHARE/MAX_MEM", int),
+            "max_cpu": ("HOST_SHARE/MAX_CPU", int),
+            "free_disk": ("HOST_SHARE/FREE_DISK", int),
+            "free_mem": ("HOST_SHARE/FREE_MEM", int),
+            "free_cpu": ("HOST_SHARE/FREE_CPU", int),
+            "used_disk": ("HOST_SHARE/USED_DISK", int),
+            "used_mem": ("HOST_SHARE/USED_MEM", int),
+            "used_cpu": ("HOST_SHARE/USED_CPU", int),
+            "running_vms": ("HOST_SHARE/RUNNING_VMS", int)
+            }
+
+    __slots__ = ("id", "name", "state", "_template") + tuple(lazyFields)
     
     def __init__(self, xmlHost):
-        self.id = int(xmlHost.find("ID").text)
-        self.name = xmlHost.find("NAME").text
-        self.state = self.states[int(xmlHost.find("STATE").text)]
-
-        self.im_mad = xmlHost.find("IM_MAD").text
-        self.vm_mad = xmlHost.find("VM_MAD").text
-        self.vn_mad = xmlHost.find("VN_MAD").text
-        self.last_mon_time = int(xmlHost.find("LAST_MON_TIME").text)
-        
-        host_share_element = xmlHost.find("HOST_SHARE")
-
-        self.disk_usage = int(host_share_element.find("DISK_USAGE").text)
-        self.mem_usage = int(host_share_element.find("MEM_USAGE").text)
-        self.cpu_usage = int(host_share_element.find("CPU_USAGE").text)
-        self.max_disk = int(host_share_element.find("MAX_DISK").text)
-        self.max_mem = int(host_share_element.find("MAX_MEM").text)
-        self.max_cpu = int(host_share_element.find("MAX_CPU").text)
-        self.free_disk = int(host_share_element.find("FREE_DISK").text)
-        self.free_mem = int(host_share_element.find("FREE_MEM").text)
-        self.free_cpu = int(host_share_element.find("FREE_CPU").text)
-        self.used_disk = int(host_share_element.find("USED_DISK").text)
-        self.used_mem = int(host_share_element.find("USED_MEM").text)
-        self.used_cpu = int(host_share_element.find("USED_CPU").text)
-        self.running_vms = int(host_share_element.find("RUNNING_VMS").text)
-
-        self.template = parse_template(xmlHost.find("TEMPLATE"))
+        LazyRecord.__init__(self, xmlHost)
+        self.id = int(self._fields["ID"].text)
+        self.name = self._fields["NAME"].text
+        self.state = self.states[int(self._fields["STATE"].text)]
+
+    @property
+    def template(self):
+        """the host template, parsed on first access"""
+        try:
+            return self._template
+        except AttributeError:
+            self._template = parse_template(self._fields.get("TEMPLATE"))
+            return self._template
 
     @classmethod
     def xmlToHost(cls, xmlStr):
@@ -281,13 +600,12 @@ class OneHost(object):
 
     @classmethod
     def xmlToHostpool(cls, xmlStr):
-        xmlHostpool = ET.fromstring(xmlStr)
-        hosts = xmlHostpool.findall("HOST")
-        return [cls(host) for host in hosts]
+        return [cls(host) for host in iter_pool(xmlStr, "HOST")]
 
-class OneVM(object):
+class OneVM(LazyRecord):
     """OneVM represents a opennebula VM with all its properties.
-    See the constructor for class variables.
+    id, name, state and lcm_state are decoded in the constructor,
+    all other fields (see lazyFields), the template and the history on first access.
     There are no getter and setter methods.
     """
     states = {
@@ -338,52 +656,93 @@ class OneVM(object):
             31: "prolog_undeploy",
             32: "boot_undeploy"
             }
+
+    lazyFields = {
+            "uid": ("UID", int),
+            "gid": ("GID", int),
+            "uname": ("UNAME", None),
+            "gname": ("GNAME", None),
+            "owner_u": ("PERMISSIONS/OWNER_U", int),
+            "owner_m": ("PERMISSIONS/OWNER_M", int),
+            "owner_a": ("PERMISSIONS/OWNER_A", int),
+            "group_u": ("PERMISSIONS/GROUP_U", int),
+            "group_m": ("PERMISSIONS/GROUP_M", int),
+            "group_a": ("PERMISSIONS/GROUP_A", int),
+            "other_u": ("PERMISSIONS/OTHER_U", int),
+            "other_m": ("PERMISSIONS/OTHER_M", int),
+            "other_a": ("PERMISSIONS/OTHER_A", int),
+            "last_poll": ("LAST_POLL", int),
+            "stime": ("STIME", int),
+            "etime": ("ETIME", int),
+            "deploy_id": ("DEPLOY_ID", None),
+            "memory": ("MEMORY", int),
+            "cpu": ("CPU", int),
+            "net_tx": ("NET_TX", int),
+            "net_rx": ("NET_RX", int)
+            }
+
+    __slots__ = ("id", "name", "state", "lcm_state", "_template", "_history", "_hostname") + tuple(lazyFields)
+
     def __init__(self, xmlVM):
-        self.id = int(xmlVM.find("ID").text)
-        self.uid = int(xmlVM.find("UID").text)
-        self.gid = int(xmlVM.find("GID").text)
-        self.uname = xmlVM.find("UNAME").text
-        self.gname = xmlVM.find("GNAME").text
-        self.name = xmlVM.find("NAME").text
-        permissions = xmlVM.find("PERMISSIONS")
-        if permissions is not None:
-            self.owner_u = int(permissions.find("OWNER_U").text)
-            self.owner_m = int(permissions.find("OWNER_M").text)
-            self.owner_a = int(permissions.find("OWNER_A").text)
-            self.group_u = int(permissions.find("GROUP_U").text)
-            self.group_m = int(permissions.find("GROUP_M").text)
-            self.group_a = int(permissions.find("GROUP_A").text)
-            self.other_u = int(permissions.find("OTHER_U").text)
-            self.other_m = int(permissions.find("OTHER_M").text)
-            self.other_a = int(permissions.find("OTHER_A").text)
-        self.last_poll = int(xmlVM.find("LAST_POLL").text)
-        self.state = self.states[int(xmlVM.find("STATE").text)]       
-        self.lcm_state = self.lcmStates[int(xmlVM.find("LCM_STATE").text)]
-        self.stime = int(xmlVM.find("STIME").text)
-        self.etime = int(xmlVM.find("ETIME").text)
-        self.deploy_id = xmlVM.find("DEPLOY_ID").text
-        self.memory =  int(xmlVM.find("MEMORY").text)
-        self.cpu = int(xmlVM.find("CPU").text)
-        self.net_tx = int(xmlVM.find("NET_TX").text)
-        self.net_rx = int(xmlVM.find("NET_RX").text)
-
-        self.template = parse_template(xmlVM.find("TEMPLATE"))
-        
+        LazyRecord.__init__(self, xmlVM)
+        self.id = int(self._fields["ID"].text)
+        self.name = self._fields["NAME"].text
+        self.state = self.states[int(self._fields["STATE"].text)]       
+        self.lcm_state = self.lcmStates[int(self._fields["LCM_STATE"].text)]
+
+    @property
+    def template(self):
+        """the VM template, parsed on first access"""
+        try:
+            return self._template
+        except AttributeError:
+            self._template = parse_template(self._fields.get("TEMPLATE"))
+            return self._template
+
+    @property
+    def history(self):
+        """all history records sorted by SEQ, parsed on first access"""
+        try:
+            return self._history
+        except AttributeError:
+            pass
+
         # get all history elements 
-        records = xmlVM.find("HISTORY_RECORDS")
-        
-        self.history = []
-        self.hostname = ""
+        records = self._fields.get("HISTORY_RECORDS")
+        self._history = []
+        if records is not None:
+            self._history = map(parse_template, records.findall("HISTORY"))
+            self._history = sorted(self._history, key=lambda record: int(record["SEQ"]))
+        return self._history
+
+    @property
+    def hostname(self):
+        """hostname of the current history record, "" without history records
+        and None for VMs created with an opennebula version < 3.4
+        """
+        try:
+            return self._hostname
+        except AttributeError:
+            pass
 
+        self._hostname = ""
+        records = self._fields.get("HISTORY_RECORDS")
         if records is not None:
-            self.history = map(parse_template, records.findall("HISTORY"))
-            self.history = sorted(self.history, key=itemgetter('SEQ'))
-            # set current hostname
-            try:
-                self.hostname = self.history[-1]["HOSTNAME"]
-            except IndexError:
+            # only the record with the highest SEQ is decoded
+            latest = None
+            latestSeq = None
+            for record in records.findall("HISTORY"):
+                seq = int(record.findtext("SEQ"))
+                if latestSeq is None or seq > latestSeq:
+                    latest = record
+                    latestSeq = seq
+
+            if latest is None:
                 # This only happens if VM was created with an opennebula version < 3.4
-                self.hostname = None
+                self._hostname = None
+            else:
+                self._hostname = latest.findtext("HOSTNAME")
+        return self._hostname
 
             
     @classmethod
@@ -393,6 +752,10 @@ class OneVM(object):
     
     @classmethod
     def xmlToVMPool(cls, xmlStr):
-        xmlVMPool = ET.fromstring(xmlStr)
-        vms = xmlVMPool.findall("VM")
-        return [cls(vm) for vm in vms]
+        return list(cls.iterVMPool(xmlStr))
+
+    @classmethod
+    def iterVMPool(cls, xmlStr):
+        """yields the OneVMs of a vmpool xml string, see iter_pool"""
+        for vm in iter_pool(xmlStr, "VM"):
+            yield cls(vm)
@@ -0,0 +1,182 @@
+# This file provides the command runner used for the batch system and ssh calls.
+# Commands are executed directly (no shell), input is passed on stdin,
+# every call is timed and counted per command.
+# CommandStream gives parsers the output of a running command.
+
+import os
+import signal
+import threading
+
+from subprocess import Popen, PIPE, STDOUT
+from tempfile import TemporaryFile
+from time import time
+
+class CommandError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+    def __str__(self):
+        return repr("%s" % (self.msg))
+
+class CommandStats(object):
+    """CommandStats counts calls, failures, timeouts, wall time and output bytes per command"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = {}
+        # observer(name, seconds, failed, timedOut) is called for every command, e.g. for metrics
+        self.observer = None
+
+    def record(self, name, seconds, outputBytes, failed=False, timedOut=False):
+        with self.lock:
+            stats = self.commands.get(name)
+            if stats is None:
+                stats = self.commands[name] = {"calls": 0, "failures": 0, "timeouts": 0, "seconds": 0.0, "bytes": 0}
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += outputBytes
+            if failed:
+                stats["failures"] += 1
+            if timedOut:
+                stats["timeouts"] += 1
+        if self.observer is not None:
+            self.observer(name, seconds, failed, timedOut)
+
+    def snapshot(self):
+        """returns a copy of the counters, command name -> dict"""
+        with self.lock:
+            return dict((name, dict(stats)) for name, stats in self.commands.items())
+
+# counters of all commands run by this process
+stats = CommandStats()
+
+class Watchdog(object):
+    """Watchdog kills the process group of process after timeout seconds (None: never)"""
+
+    def __init__(self, process, timeout):
+        self.process = process
+        self.timedOut = False
+        self.timer = None
+        if timeout:
+            self.timer = threading.Timer(timeout, self.kill)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def kill(self):
+        self.timedOut = True
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+def startCommand(argv, stderr, errorClass):
+    """starts argv in its own process group, so a timeout kills the children of the command too"""
+    try:
+        return Popen(argv, stdin=PIPE, stdout=PIPE, stderr=stderr, close_fds=True, preexec_fn=os.setsid)
+    except OSError:
+        stats.record(os.path.basename(argv[0]), 0.0, 0, failed=True)
+        raise commandError(errorClass, "%s command \"%s\" not found" % (os.path.basename(argv[0]), argv[0]), "", None)
+
+def runCommand(argv, input=None, timeout=None, errorClass=CommandError, okCodes=(0,)):
+    """runs argv and returns its output (stdout and stderr).
+    input is written to stdin, a command running longer than timeout seconds is killed.
+    Raises errorClass if the command can't be started, times out or exits with a code not in okCodes.
+    The raised error has the attributes output and returncode,
+    returncode is None if the command could not be started or timed out.
+    """
+    name = os.path.basename(argv[0])
+    start = time()
+    process = startCommand(argv, STDOUT, errorClass)
+    watchdog = Watchdog(process, timeout)
+    try:
+        output = process.communicate(input)[0]
+    finally:
+        watchdog.cancel()
+
+    failed = watchdog.timedOut or not process.returncode in okCodes
+    stats.record(name, time() - start, len(output), failed=failed, timedOut=watchdog.timedOut)
+    if watchdog.timedOut:
+        raise commandError(errorClass, "%s timed out after %s sec" % (name, timeout), output, None)
+    if failed:
+        raise commandError(errorClass, "%s failed: %s" % (name, output.strip()), output, process.returncode)
+    return output
+
+class CommandStream(object):
+    """CommandStream runs argv and gives access to its stdout while it runs,
+    records are parsed as they arrive instead of from a copy of the whole output.
+    It is used as a context manager:
+
+        with CommandStream(argv, timeout=60, errorClass=SGEError) as stream:
+            for line in stream:
+                ...
+
+    Iterating yields the lines, read() makes it a file object for parsers like iterparse.
+    Leaving the block waits for the command and raises errorClass like runCommand,
+    stderr is kept in a temporary file for the error message.
+    """
+
+    def __init__(self, argv, input=None, timeout=None, errorClass=CommandError, okCodes=(0,)):
+        self.argv = argv
+        self.name = os.path.basename(argv[0])
+        self.input = input
+        self.timeout = timeout
+        self.errorClass = errorClass
+        self.okCodes = okCodes
+        self.bytes = 0
+
+    def __enter__(self):
+        self.start = time()
+        self.stderr = TemporaryFile()
+        self.process = startCommand(self.argv, self.stderr, self.errorClass)
+        self.watchdog = Watchdog(self.process, self.timeout)
+        try:
+            if self.input is not None:
+                self.process.stdin.write(self.input)
+        except IOError:
+            pass
+        self.process.stdin.close()
+        return self
+
+    def __iter__(self):
+        for line in self.process.stdout:
+            self.bytes += len(line)
+            yield line
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        self.bytes += len(data)
+        return data
+
+    def __exit__(self, excType, excValue, traceback):
+        timedOut = self.watchdog.timedOut
+        # a command still writing after a parse error is ended by SIGPIPE
+        self.process.stdout.close()
+        if excType is not None and self.timeout is None and self.process.poll() is None:
+            self.watchdog.kill()
+        self.process.wait()
+        self.watchdog.cancel()
+        timedOut = timedOut or (self.watchdog.timedOut and self.timeout is not None)
+
+        self.stderr.seek(0)
+        errors = self.stderr.read()
+        self.stderr.close()
+
+        failed = excType is not None or timedOut or not self.process.returncode in self.okCodes
+        stats.record(self.name, time() - self.start, self.bytes, failed=failed, timedOut=timedOut)
+        # a timeout or error exit truncates the output, it is reported instead of the resulting parse error
+        if timedOut:
+            raise commandError(self.errorClass, "%s timed out after %s sec" % (self.name, self.timeout), errors, None)
+        if excType is not None and not self.process.returncode > 0:
+            return False
+        if failed:
+            raise commandError(self.errorClass, "%s failed: %s" % (self.name, errors.strip()), errors, self.process.returncode)
+        return False
+
+def commandError(errorClass, msg, output, returncode):
+    error = errorClass(msg)
+    error.output = output
+    error.returncode = returncode
+    return error
@@ -4,6 +4,7 @@
 
 import sys
 import os
+import shlex
 
 try:
     from configobj import ConfigObj
@@ -39,9 +40,18 @@ class Config(object):
         
         self.sleepTime = 0
         self.shutdownTimeout = 0
+        self.stateDir = ""
 
         self.oneRPC = {}
         self.sge = {}
+        self.slurm = {}
+        self.actions = {}
+        self.timeouts = {}
+        self.log = {}
+        self.stats = {}
+        self.metrics = {}
+        # warnings about the config file (deprecated options), logged by the scheduler
+        self.warnings = []
 
 
     def createConfig(self):
@@ -89,23 +99,77 @@ class Config(object):
 
         self.sleepTime = config["sleepTime"]
         self.shutdownTimeout = config["shutdownTimeout"]
+        self.stateDir = config["stateDir"]
+        if self.stateDir == "":
+            oneLocation = os.getenv("ONE_LOCATION")
+            if oneLocation is None:
+                self.stateDir = "/var/lib/one"
+            else:
+                self.stateDir = os.path.join(oneLocation, "var")
 
         self.oneRPC["hostname"] = config["OneRPC"]["hostname"]
         self.oneRPC["port"] = config["OneRPC"]["port"]
         self.oneRPC["startVM"] = config["OneRPC"]["startVM"]
+        self.oneRPC["vmStateFilter"] = config["OneRPC"]["vmStateFilter"]
+        self.oneRPC["pageSize"] = config["OneRPC"]["pageSize"]
+        self.oneRPC["batchSize"] = config["OneRPC"]["batchSize"]
+        self.oneRPC["connections"] = config["OneRPC"]["connections"]
 
         self.sge["qsub"] =  config["SGE"]["qsub"]
         self.sge["qstat"] =  config["SGE"]["qstat"]
         self.sge["qdel"] =  config["SGE"]["qdel"]
         self.sge["qhost"] = config["SGE"]["qhost"]
-        self.sge["idleCmd"] =  config["SGE"]["idleCmd"]
+        self.sge["idleScript"] =  config["SGE"]["idleScript"]
+        if "idleCmd" in config["SGE"]:
+            self.sge["idleScript"] = self.translateIdleCmd(config["SGE"]["idleCmd"], config["SGE"])
+        self.sge["finishedJobs"] = config["SGE"]["finishedJobs"]
+        self.sge["finishedWindow"] = config["SGE"]["finishedWindow"]
+        self.sge["zombieSweep"] = config["SGE"]["zombieSweep"]
         self.sge["parallelEnvironment"] = config["SGE"]["parallelEnvironment"]
         self.sge["queue"] = config["SGE"]["queue"]
         self.sge["hostSuffix"] = config["SGE"]["hostSuffix"]
+        self.sge["queueHostsTTL"] = config["SGE"]["queueHostsTTL"]
+
+        self.slurm["sbatch"] = config["Slurm"]["sbatch"]
+        self.slurm["idleScript"] = config["Slurm"]["idleScript"]
+        self.slurm["maxArraySize"] = config["Slurm"]["maxArraySize"]
+        self.slurm["squeue"] = config["Slurm"]["squeue"]
+        self.slurm["sacct"] = config["Slurm"]["sacct"]
+        self.slurm["scancel"] = config["Slurm"]["scancel"]
+        self.slurm["sinfo"] = config["Slurm"]["sinfo"]
+        self.slurm["finishedWindow"] = config["Slurm"]["finishedWindow"]
+
+        self.actions["workers"] = config["Actions"]["workers"]
+        self.actions["deploy"] = config["Actions"]["deploy"]
+        self.actions["shutdown"] = config["Actions"]["shutdown"]
+        self.actions["destroy"] = config["Actions"]["destroy"]
+        self.actions["delete"] = config["Actions"]["delete"]
+
+        self.timeouts["loadHosts"] = config["Timeouts"]["loadHosts"]
+        self.timeouts["loadVMs"] = config["Timeouts"]["loadVMs"]
+        self.timeouts["loadJobs"] = config["Timeouts"]["loadJobs"]
+        self.timeouts["batchCommand"] = config["Timeouts"]["batchCommand"]
+        self.timeouts["rpc"] = config["Timeouts"]["rpc"]
+        self.timeouts["ssh"] = config["Timeouts"]["ssh"]
+
+        self.log["flushSize"] = config["Log"]["flushSize"]
+        self.log["flushInterval"] = config["Log"]["flushInterval"]
+        self.log["level"] = config["Log"]["level"]
+        self.log["rateBurst"] = config["Log"]["rateBurst"]
+        self.log["rateInterval"] = config["Log"]["rateInterval"]
+        self.log["rateKeys"] = config["Log"]["rateKeys"]
+
+        self.stats["history"] = config["Stats"]["history"]
+        self.stats["cycleBudget"] = config["Stats"]["cycleBudget"]
+
+        self.metrics["port"] = config["Metrics"]["port"]
+        self.metrics["address"] = config["Metrics"]["address"]
+        self.metrics["textfile"] = config["Metrics"]["textfile"]
 
         
         # values missing, report which default values were used
-        if len(config.defaults) > 0 or len(config["OneRPC"].defaults) > 0 or len(config["SGE"].defaults) > 0:
+        sections = ["OneRPC", "SGE", "Slurm", "Actions", "Timeouts", "Log", "Stats", "Metrics"]
+        if len(config.defaults) > 0 or any(len(config[section].defaults) > 0 for section in sections):
             missing = "Root: "
             if len(config.defaults) > 0:
                 for option in config.defaults:
@@ -113,22 +177,33 @@ class Config(object):
             else:
                 missing += "is complete"
             
-            missing += "; Section OneRPC: "
-            if len(config["OneRPC"].defaults) > 0:
-                for option in config["OneRPC"].defaults:
-                    missing += "%s," % option
-            else:
-                missing += "is complete"
-
-            missing += "; Section SGE: "
-            if len(config["SGE"].defaults) > 0:
-                for option in config["SGE"].defaults:
-                    missing += "%s," % option
-            else:
-                missing += "is complete"
+            for section in sections:
+                missing += "; Section %s: " % section
+                if len(config[section].defaults) > 0:
+                    for option in config[section].defaults:
+                        missing += "%s," % option
+                else:
+                    missing += "is complete"
             
             return (True, "missing", missing)
 
         # everything worked fine, nothing to report
         return (True, "", "")
 
+    def translateIdleCmd(self, idleCmd, section):
+        """returns the idleScript of the deprecated [SGE] idleCmd option.
+        idleCmd was a shell command printing the job script, only "echo <script>" can be translated.
+        """
+        if not "idleScript" in section.defaults:
+            self.warnings.append("[SGE] idleCmd is deprecated and ignored, idleScript is set")
+            return section["idleScript"]
+        try:
+            argv = shlex.split(idleCmd)
+        except ValueError:
+            argv = []
+        if len(argv) < 2 or argv[0] != "echo":
+            raise ConfigError("deprecatedOption", "[SGE] idleCmd is no longer supported, "
+                    "set idleScript to the job script idleCmd printed (see configspec)")
+        idleScript = " ".join(argv[1:])
+        self.warnings.append("[SGE] idleCmd is deprecated, replace it with idleScript = \"%s\"" % idleScript)
+        return idleScript
@@ -0,0 +1,77 @@
+# This file provides the action executor.
+# Independent VM actions (deploy, shutdown, delete, ...) are run concurrently
+# by a bounded number of worker threads, each action type can be limited further.
+
+import threading
+
+from Queue import Queue, Empty
+
+class ActionResult(object):
+    """ActionResult is the outcome of one action.
+    key identifies the action for the caller (e.g. the VM),
+    result is the return value of the action function, error the raised exception.
+    """
+
+    def __init__(self, action, key, result=None, error=None):
+        self.action = action
+        self.key = key
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+class ActionExecutor(object):
+    """ActionExecutor runs actions with at most workers threads.
+    limits maps an action type to the number of actions of this type running at the same time.
+    """
+
+    def __init__(self, workers=8, limits=None):
+        self.workers = max(1, workers)
+        self.limits = {}
+        if limits is not None:
+            for action, limit in limits.items():
+                self.limits[action] = threading.BoundedSemaphore(max(1, limit))
+
+    def run(self, actions):
+        """run executes actions, a list of (action, key, function, args) tuples,
+        and waits for all of them. Returns the ActionResults in the order of actions.
+        """
+        results = [None] * len(actions)
+        if len(actions) == 0:
+            return results
+
+        tasks = Queue()
+        for position, task in enumerate(actions):
+            tasks.put((position, task))
+
+        workers = []
+        for i in range(min(self.workers, len(actions))):
+            worker = threading.Thread(target=self.work, args=(tasks, results), name="action-%i" % i)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+        return results
+
+    def work(self, tasks, results):
+        """worker loop, runs tasks until the queue is empty"""
+        while True:
+            try:
+                position, (action, key, function, args) = tasks.get_nowait()
+            except Empty:
+                return
+
+            limit = self.limits.get(action)
+            if limit is not None:
+                limit.acquire()
+            try:
+                results[position] = ActionResult(action, key, result=function(*args))
+            except Exception, error:
+                results[position] = ActionResult(action, key, error=error)
+            finally:
+                if limit is not None:
+                    limit.release()
@@ -1,17 +1,39 @@
 import sys
 import os
+import atexit
+import threading
 
 from datetime import datetime
+from time import time
+from Queue import Queue, Empty
+from collections import OrderedDict
 
 class Log(object):
+    """Log writes the scheduler and oned log lines.
+    Lines are queued and written by a background thread, which keeps the files open
+    and writes them in batches of flushSize lines or every flushInterval seconds.
+    The files are reopened after reopen() (SIGHUP) or if they were rotated.
+    Messages below level are dropped, the writeSchedLogf/writeOnedLogf forms
+    only format their message if it is written.
+    writeSchedLogLimited writes only the first rateBurst messages of a key every rateInterval seconds,
+    the suppressed ones are summarized, at most rateKeys keys are tracked.
+    """
     logTypes = {
             "error" : "E",
             "warning" : "W",
             "info" : "I",
             "debug" : "D"
             }
-    
-    def __init__(self):
+
+    # a log type is written if its level is at least the level of Log.level
+    levels = {
+            "error" : 40,
+            "warning" : 30,
+            "info" : 20,
+            "debug" : 10
+            }
+
+    def __init__(self, flushSize=100, flushInterval=1.0, level="info", rateBurst=5, rateInterval=300, rateKeys=1000):
         oneLocation = os.getenv("ONE_LOCATION")
         if oneLocation is None:
             self.onedFile = "/var/log/one/oned.log"
@@ -20,24 +42,259 @@ class Log(object):
             self.onedFile = os.path.join(oneLocation, "var/oned.log")
             self.schedFile = os.path.join(oneLocation, "var/sched.log")
 
-    def writeOnedLog(self, logType, *msg):
-        if logType not in self.logTypes.keys():
+        self.flushSize = flushSize
+        self.flushInterval = flushInterval
+        self.setLevel(level)
+
+        self.rateBurst = rateBurst
+        self.rateInterval = rateInterval
+        self.rateKeys = rateKeys
+        # key -> RateWindow, least recently used first
+        self.rates = OrderedDict()
+        self.ratesLock = threading.Lock()
+
+        self.queue = Queue()
+        self.handles = {}
+        self.reopenRequested = False
+        self.lock = threading.Lock()
+        self.writer = None
+        # (second, ctime string) of the last timestamp
+        self.stamp = (None, "")
+        atexit.register(self.close)
+
+    def configure(self, flushSize=None, flushInterval=None, level=None, rateBurst=None, rateInterval=None, rateKeys=None):
+        """changes the flush thresholds, the level and the rate limits, e.g. after the config was read"""
+        if flushSize is not None:
+            self.flushSize = flushSize
+        if flushInterval is not None:
+            self.flushInterval = flushInterval
+        if level is not None:
+            self.setLevel(level)
+        if rateBurst is not None:
+            self.rateBurst = rateBurst
+        if rateInterval is not None:
+            self.rateInterval = rateInterval
+        if rateKeys is not None:
+            self.rateKeys = rateKeys
+
+    def setLevel(self, level):
+        if level not in self.levels:
             raise KeyError("unknown log type")
+        self.level = level
+        self.enabled = frozenset(logType for logType in self.levels if self.levels[logType] >= self.levels[level])
+
+    def isEnabledFor(self, logType):
+        """True if messages of logType are written"""
+        return logType in self.enabled
+
+    def writeOnedLog(self, logType, *msg):
+        if logType not in self.enabled:
+            if logType not in self.logTypes:
+                raise KeyError("unknown log type")
+            return
         self.write(self.onedFile, logType, msg)
 
     def writeSchedLog(self, logType, *msg):
-        if logType not in self.logTypes.keys():
-            raise KeyError("unknown log type")        
+        if logType not in self.enabled:
+            if logType not in self.logTypes:
+                raise KeyError("unknown log type")
+            return
         self.write(self.schedFile, logType, msg)
 
+    def writeOnedLogf(self, logType, fmt, *args):
+        """writes fmt % args, or fmt(*args) if fmt is callable, if logType is enabled"""
+        if logType in self.enabled:
+            self.write(self.onedFile, logType, (self.format(fmt, args),))
+        elif logType not in self.logTypes:
+            raise KeyError("unknown log type")
+
+    def writeSchedLogf(self, logType, fmt, *args):
+        """writes fmt % args, or fmt(*args) if fmt is callable, if logType is enabled"""
+        if logType in self.enabled:
+            self.write(self.schedFile, logType, (self.format(fmt, args),))
+        elif logType not in self.logTypes:
+            raise KeyError("unknown log type")
+
+    def writeSchedLogLimited(self, logType, key, fmt, *args):
+        """like writeSchedLogf, but rate limited per key, e.g. (message template, error code)"""
+        if logType not in self.enabled:
+            if logType not in self.logTypes:
+                raise KeyError("unknown log type")
+            return
+
+        now = time()
+        summaries = []
+        with self.ratesLock:
+            window = self.rates.pop(key, None)
+            if window is not None and now - window.start >= self.rateInterval:
+                summaries.append(window)
+                window = None
+            if window is None:
+                window = RateWindow(logType, fmt, now)
+            self.rates[key] = window
+            while len(self.rates) > self.rateKeys:
+                summaries.append(self.rates.popitem(last=False)[1])
+
+            window.count += 1
+            if window.count > self.rateBurst:
+                window.suppressed += 1
+                window.args = args
+                write = False
+            else:
+                write = True
+
+        self.writeSummaries(summaries)
+        if write:
+            self.write(self.schedFile, logType, (self.format(fmt, args),))
+
+    def summarizeSuppressed(self):
+        """writes the summaries of the rate windows which ended, should be called regularly (every cycle)"""
+        now = time()
+        summaries = []
+        with self.ratesLock:
+            for key, window in self.rates.items():
+                if now - window.start >= self.rateInterval:
+                    del self.rates[key]
+                    summaries.append(window)
+        self.writeSummaries(summaries)
+
+    def writeSummaries(self, windows):
+        for window in windows:
+            if window.suppressed > 0:
+                self.write(self.schedFile, window.logType, ("suppressed %i similar messages, last: %s" %
+                        (window.suppressed, self.format(window.fmt, window.args)),))
+
+    @staticmethod
+    def format(fmt, args):
+        if callable(fmt):
+            return fmt(*args)
+        if args:
+            return fmt % args
+        return fmt
+
+    def timestamp(self):
+        """ctime of now, formatted once per second"""
+        second = int(time())
+        stamp = self.stamp
+        if stamp[0] != second:
+            stamp = (second, datetime.fromtimestamp(second).ctime())
+            self.stamp = stamp
+        return stamp[1]
+
     def write(self, filename, logType, msgList):
-        try:
-            f = file(filename, "a+")
-            for msg in msgList:
-                f.write("%s [SCHED][%s]: %s\n" % (datetime.now().ctime(), self.logTypes[logType], msg))
+        stamp = self.timestamp()
+        for msg in msgList:
+            self.queue.put((filename, "%s [SCHED][%s]: %s\n" % (stamp, self.logTypes[logType], msg)))
+        self.startWriter()
+
+    def startWriter(self):
+        if self.writer is not None:
+            return
+        with self.lock:
+            if self.writer is None:
+                writer = threading.Thread(target=self.work, name="log-writer")
+                writer.daemon = True
+                writer.start()
+                self.writer = writer
+
+    def work(self):
+        """writer loop, collects the queued lines per file and writes them in batches"""
+        pending = {}
+        count = 0
+        deadline = time() + self.flushInterval
+        while True:
+            try:
+                record = self.queue.get(timeout=max(0.0, deadline - time()))
+            except Empty:
+                record = None
+
+            if record is self.stop:
+                self.flushLines(pending)
+                self.closeHandles()
+                for i in range(count + 1):
+                    self.queue.task_done()
+                return
+
+            if record is not None:
+                filename, line = record
+                pending.setdefault(filename, []).append(line)
+                count += 1
+
+            if count >= self.flushSize or time() >= deadline:
+                self.flushLines(pending)
+                for i in range(count):
+                    self.queue.task_done()
+                pending = {}
+                count = 0
+                deadline = time() + self.flushInterval
+
+    def flushLines(self, pending):
+        if self.reopenRequested:
+            self.reopenRequested = False
+            self.closeHandles()
+        for filename, lines in pending.items():
+            try:
+                f = self.handle(filename)
+                f.write("".join(lines))
+                f.flush()
+            except IOError, err:
+                self.handles.pop(filename, None)
+                sys.stderr.write("Logging failed: %s\n" % err)
+                for line in lines:
+                    sys.stderr.write("i3sched error: %s" % line)
+
+    def handle(self, filename):
+        """returns the open file of filename, it is reopened if it was moved or removed (log rotation)"""
+        f = self.handles.get(filename)
+        if f is not None:
+            try:
+                rotated = os.stat(filename).st_ino != os.fstat(f.fileno()).st_ino
+            except OSError:
+                rotated = True
+            if not rotated:
+                return f
             f.close()
-        except IOError, err:
-            sys.stderr.write("Logging failed: %s\n" % err)
-            for msg in msgList:
-                sys.stderr.write("i3sched error: %s\n" % msg)
+        f = self.handles[filename] = open(filename, "a")
+        return f
+
+    def closeHandles(self):
+        handles = self.handles
+        self.handles = {}
+        for f in handles.values():
+            try:
+                f.close()
+            except IOError:
+                pass
+
+    def reopen(self):
+        """reopens the log files before the next write (SIGHUP)"""
+        self.reopenRequested = True
+
+    def flush(self):
+        """waits until all queued lines are written"""
+        if self.writer is not None:
+            self.queue.join()
+
+    # queued by close(), ends the writer thread
+    stop = object()
+
+    def close(self):
+        """writes the queued lines, closes the files and stops the writer thread"""
+        with self.lock:
+            writer = self.writer
+            self.writer = None
+        if writer is not None:
+            self.queue.put(self.stop)
+            writer.join()
+
+class RateWindow(object):
+    """RateWindow counts the messages of one rate limited key since start"""
+    __slots__ = ("logType", "fmt", "args", "start", "count", "suppressed")
 
+    def __init__(self, logType, fmt, start):
+        self.logType = logType
+        self.fmt = fmt
+        self.args = ()
+        self.start = start
+        self.count = 0
+        self.suppressed = 0
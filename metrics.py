@@ -0,0 +1,167 @@
+# This file provides the scheduler metrics in the Prometheus text format.
+# Metrics are updated with a short lock per metric, the text is rendered on demand
+# by the HTTP server thread or written to a file for the node exporter textfile collector.
+
+import os
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from bisect import bisect_left
+
+def labelString(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in zip(names, values))
+
+class Counter(object):
+    """Counter is a monotonically increasing value per label combination"""
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return ["%s%s %s" % (self.name, labelString(self.labels, labels), value) for labels, value in values]
+
+class Gauge(Counter):
+    """Gauge is a value per label combination which is set as a whole every cycle"""
+    kind = "gauge"
+
+    def set(self, values):
+        """replaces all values, values maps label tuples to numbers"""
+        with self.lock:
+            self.values = dict(values)
+
+class Histogram(object):
+    """Histogram counts observations in cumulative buckets per label combination"""
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = sorted(buckets)
+        # labels -> [bucket counts ..., count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        lines = []
+        names = self.labels + ("le",)
+        for labels, counts in values:
+            cumulative = 0
+            for bucket, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("%s_bucket%s %i" % (self.name, labelString(names, labels + (repr(float(bucket)),)), cumulative))
+            cumulative += counts[len(self.buckets)]
+            lines.append("%s_bucket%s %i" % (self.name, labelString(names, labels + ("+Inf",)), cumulative))
+            lines.append("%s_count%s %i" % (self.name, labelString(self.labels, labels), cumulative))
+            lines.append("%s_sum%s %s" % (self.name, labelString(self.labels, labels), repr(counts[-1])))
+        return lines
+
+class Metrics(object):
+    """Metrics holds all metrics of the scheduler"""
+
+    latencyBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    cycleBuckets = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.rpcCalls = Counter("i3sched_rpc_calls_total", "XML RPC calls to oned", ("method",))
+        self.rpcFailures = Counter("i3sched_rpc_failures_total", "failed XML RPC calls to oned", ("method",))
+        self.commandCalls = Counter("i3sched_command_calls_total", "batch system and ssh commands run", ("command",))
+        self.commandFailures = Counter("i3sched_command_failures_total", "failed commands", ("command",))
+        self.commandTimeouts = Counter("i3sched_command_timeouts_total", "commands killed after their timeout", ("command",))
+        self.callSeconds = Histogram("i3sched_call_seconds", "latency of the external calls", self.latencyBuckets, ("kind", "name"))
+        self.vms = Gauge("i3sched_vms", "VMs of the last cycle", ("state", "lcm_state"))
+        self.jobs = Gauge("i3sched_jobs", "batch jobs of the last cycle", ("state",))
+        self.actions = Counter("i3sched_actions_total", "actions issued by the reconciliation passes", ("pass", "action"))
+        self.cycles = Counter("i3sched_cycles_total", "scheduling cycles")
+        self.cycleSeconds = Histogram("i3sched_cycle_seconds", "duration of the scheduling cycles", self.cycleBuckets)
+        self.all = [self.rpcCalls, self.rpcFailures, self.commandCalls, self.commandFailures, self.commandTimeouts,
+                self.callSeconds, self.vms, self.jobs, self.actions, self.cycles, self.cycleSeconds]
+
+    def observeRPC(self, method, seconds, failed):
+        """OneRPC observer"""
+        self.rpcCalls.inc((method,))
+        if failed:
+            self.rpcFailures.inc((method,))
+        if seconds is not None:
+            self.callSeconds.observe(seconds, ("rpc", method))
+
+    def observeCommand(self, name, seconds, failed, timedOut):
+        """command.stats observer"""
+        self.commandCalls.inc((name,))
+        if failed:
+            self.commandFailures.inc((name,))
+        if timedOut:
+            self.commandTimeouts.inc((name,))
+        self.callSeconds.observe(seconds, ("command", name))
+
+    def render(self):
+        """returns all metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.all:
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def writeTextfile(self, filename):
+        """writes the metrics to filename for the textfile collector, the file is replaced atomically"""
+        tmpFile = filename + ".tmp"
+        with open(tmpFile, "w") as f:
+            f.write(self.render())
+        os.rename(tmpFile, filename)
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not logged
+        pass
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """MetricsServer serves the metrics on http://address:port/metrics from daemon threads"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, metrics, address="127.0.0.1", port=9111):
+        BaseHTTPServer.HTTPServer.__init__(self, (address, port), MetricsHandler)
+        self.metrics = metrics
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name="metrics")
+        thread.daemon = True
+        thread.start()
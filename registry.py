@@ -0,0 +1,104 @@
+# This file provides the job registry.
+# It maps the OpenNebula VM ids to the ids of their batch jobs and back,
+# so jobs are only identified by their 'one-<vmid>' name once.
+
+import os
+
+class JobRegistry(object):
+    """JobRegistry maps VM ids to batch job ids and back.
+    It is filled from the job ids returned by submitJob(s) and from the job snapshots
+    and can be persisted in stateFile, one 'vmid jobid' line per job.
+    """
+
+    def __init__(self, stateFile=None):
+        self.stateFile = stateFile
+        self.jobs = {}
+        self.vms = {}
+        self.changed = False
+        self.load()
+
+    @staticmethod
+    def jobName(vmid):
+        """returns the batch job name used for the VM with vmid"""
+        return "one-%i" % vmid
+
+    @staticmethod
+    def parseName(jobName):
+        """returns the VM id encoded in a batch job name or None"""
+        if jobName is None or not jobName.startswith("one-"):
+            return None
+        try:
+            return int(jobName[4:])
+        except ValueError:
+            return None
+
+    def register(self, vmid, jobId):
+        """records jobId as the job of the VM vmid"""
+        jobId = str(jobId)
+        if self.jobs.get(vmid) == jobId:
+            return
+        old = self.jobs.get(vmid)
+        if old is not None:
+            self.vms.pop(old, None)
+        self.jobs[vmid] = jobId
+        self.vms[jobId] = vmid
+        self.changed = True
+
+    def forget(self, jobId):
+        """removes the job jobId"""
+        vmid = self.vms.pop(str(jobId), None)
+        if vmid is not None:
+            if self.jobs.get(vmid) == str(jobId):
+                del self.jobs[vmid]
+            self.changed = True
+
+    def jobID(self, vmid):
+        """returns the id of the job of the VM vmid or None"""
+        return self.jobs.get(vmid)
+
+    def vmID(self, job):
+        """returns the VM id of job, the job name is only parsed for unknown jobs"""
+        vmid = self.vms.get(job.id)
+        if vmid is None:
+            vmid = self.parseName(job.name)
+            # a second job with the name of a registered job does not replace it
+            if vmid is not None and not vmid in self.jobs:
+                self.register(vmid, job.id)
+        return vmid
+
+    def update(self, jobs):
+        """registers the jobs of a snapshot and forgets the jobs which are no longer listed"""
+        listed = set()
+        for job in jobs:
+            if self.vmID(job) is not None:
+                listed.add(job.id)
+        for jobId in [jobId for jobId in self.vms if not jobId in listed]:
+            self.forget(jobId)
+
+    def load(self):
+        if self.stateFile is None:
+            return
+        try:
+            with open(self.stateFile) as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) == 2 and fields[0].isdigit():
+                        self.register(int(fields[0]), fields[1])
+        except IOError:
+            pass
+        self.changed = False
+
+    def save(self):
+        """writes the registry to stateFile if it changed"""
+        if self.stateFile is None or not self.changed:
+            return
+        # the registry can be rebuilt from the job names, if it can't be written it is kept in memory
+        try:
+            tmpFile = self.stateFile + ".tmp"
+            with open(tmpFile, "w") as f:
+                for vmid, jobId in sorted(self.jobs.items()):
+                    f.write("%i %s\n" % (vmid, jobId))
+            os.rename(tmpFile, self.stateFile)
+            self.changed = False
+        except (IOError, OSError):
+            pass
@@ -9,15 +9,14 @@ if sys.version_info.major != 2:
 
 import os
 import signal
+import socket
 
 from time import sleep
 from time import time
 
-import subprocess
-from subprocess import check_output as cmd
 
-from operator import itemgetter
-from itertools import groupby
+from functools import partial
+from collections import OrderedDict
 
 try:
     from logging import Log
@@ -49,6 +48,89 @@ except ImportError:
     print "slurm.py not found"
     sys.exit(1)
 
+try:
+    from snapshot import SnapshotLoader, SnapshotError
+except ImportError:
+    print "snapshot.py not found"
+    sys.exit(1)
+
+try:
+    from executor import ActionExecutor
+except ImportError:
+    print "executor.py not found"
+    sys.exit(1)
+
+try:
+    import command
+    from command import runCommand, CommandError
+except ImportError:
+    print "command.py not found"
+    sys.exit(1)
+
+try:
+    from stats import CycleHistory
+except ImportError:
+    print "stats.py not found"
+    sys.exit(1)
+
+try:
+    from registry import JobRegistry
+except ImportError:
+    print "registry.py not found"
+    sys.exit(1)
+
+try:
+    from metrics import Metrics, MetricsServer
+except ImportError:
+    print "metrics.py not found"
+    sys.exit(1)
+
+# errors raised by the batch system backends
+batchErrors = (SGEError, SlurmError)
+
+class CycleIndex(object):
+    """CycleIndex is a hash index over the VMs and batch jobs of one scheduling cycle.
+    It is built once after loadVMs/loadJobs and shared by all reconciliation passes,
+    so every lookup is a dict access instead of a walk over all jobs or VMs.
+    Jobs are keyed by their VM id from the JobRegistry.
+    """
+
+    jobName = staticmethod(JobRegistry.jobName)
+    vmID = staticmethod(JobRegistry.parseName)
+
+    def __init__(self, runningVMs, pendingVMs, runningJobs, pendingJobs, registry):
+        self.registry = registry
+        self.runningVMs = dict((vm.id, vm) for vm in runningVMs)
+        self.pendingVMs = dict((vm.id, vm) for vm in pendingVMs)
+        self.runningJobs = self.jobsByVM(runningJobs)
+        self.pendingJobs = self.jobsByVM(pendingJobs)
+
+    def jobsByVM(self, jobs):
+        """maps VM ids to jobs, the registered job of a VM wins over other jobs with its name"""
+        index = {}
+        for job in jobs:
+            vmid = self.registry.vmID(job)
+            if vmid is None:
+                continue
+            if vmid not in index or self.registry.jobID(vmid) == job.id:
+                index[vmid] = job
+        return index
+
+    def hasVM(self, vmid):
+        return vmid in self.runningVMs or vmid in self.pendingVMs
+
+    def hasJob(self, vmid):
+        return vmid in self.runningJobs or vmid in self.pendingJobs
+
+    def vmDeployed(self, vm):
+        """moves vm from the pending to the running VMs"""
+        self.pendingVMs.pop(vm.id, None)
+        self.runningVMs[vm.id] = vm
+
+    def vmRemoved(self, vm):
+        """removes vm from the running VMs"""
+        self.runningVMs.pop(vm.id, None)
+
 class Scheduler(object):
 
     def __init__(self):
@@ -73,6 +155,9 @@ class Scheduler(object):
             if err.error == "readError":
                 self.log.writeSchedLog("error", err.msg)
                 sys.exit(1)
+            if err.error == "deprecatedOption":
+                self.log.writeSchedLog("error", err.msg)
+                sys.exit(1)
         if status == False:
             self.log.writeSchedLog("error", "Could not validate config")
             self.log.writeSchedLog("error", "You can create a valid config with Config.createConfig(). See the configspec")
@@ -80,6 +165,12 @@ class Scheduler(object):
 
         if status == True and info == "missing":
             self.log.writeSchedLog("info", "Config options missing (defaults will be used): %s" % msg)            
+        for warning in self.cfg.warnings:
+            self.log.writeSchedLog("warning", warning)
+
+        self.log.configure(flushSize=self.cfg.log["flushSize"], flushInterval=self.cfg.log["flushInterval"],
+                level=self.cfg.log["level"], rateBurst=self.cfg.log["rateBurst"],
+                rateInterval=self.cfg.log["rateInterval"], rateKeys=self.cfg.log["rateKeys"])
             
         # time in seconds between two schedule cycles
         self.sleepTime = self.cfg.sleepTime
@@ -88,7 +179,8 @@ class Scheduler(object):
          
         # RPC object
         try:
-            self.rpc = OneRPC(hostname=self.cfg.oneRPC["hostname"], port=self.cfg.oneRPC["port"])
+            self.rpc = OneRPC(hostname=self.cfg.oneRPC["hostname"], port=self.cfg.oneRPC["port"],
+                    connections=self.cfg.oneRPC["connections"], timeout=self.cfg.timeouts["rpc"])
         except OneError, error:
             self.log.writeSchedLog("error", "%s" % error)
             self.log.writeOnedLog("error", "Scheduler stopped: %s" % error)
@@ -102,12 +194,18 @@ class Scheduler(object):
         # SGE object
         try:
             #self.sge = SGE(qsub=self.cfg.sge["qsub"], qstat=self.cfg.sge["qstat"], qdel=self.cfg.sge["qdel"], qhost=self.cfg.sge["qhost"],
-            #        idleCmd=self.cfg.sge["idleCmd"], standardParallelEnvironment=self.cfg.sge["parallelEnvironment"], 
-            #        standardQueue=self.cfg.sge["queue"], standardHostSuffix=self.cfg.sge["hostSuffix"])
-	    self.scheduler = Slurm(qsub=self.cfg.sge["qsub"], squeue="squeue", sacct="sacct", qdel=self.cfg.sge["qdel"], qhost=self.cfg.sge["qhost"],
-	                     idleCmd=self.cfg.sge["idleCmd"], standardParallelEnvironment=self.cfg.sge["parallelEnvironment"],
-			     standardQueue=self.cfg.sge["queue"], standardHostSuffix=self.cfg.sge["hostSuffix"])
-        except SGEError, error:
+            #        idleScript=self.cfg.sge["idleScript"], standardParallelEnvironment=self.cfg.sge["parallelEnvironment"], 
+            #        standardQueue=self.cfg.sge["queue"], standardHostSuffix=self.cfg.sge["hostSuffix"],
+            #        queueHostsTTL=self.cfg.sge["queueHostsTTL"], commandTimeout=self.cfg.timeouts["batchCommand"],
+            #        finishedJobs=self.cfg.sge["finishedJobs"], zombieSweep=self.cfg.sge["zombieSweep"],
+            #        finishedWindow=self.cfg.sge["finishedWindow"])
+	    self.scheduler = Slurm(sbatch=self.cfg.slurm["sbatch"], squeue=self.cfg.slurm["squeue"], sacct=self.cfg.slurm["sacct"], scancel=self.cfg.slurm["scancel"], sinfo=self.cfg.slurm["sinfo"],
+	                     idleScript=self.cfg.slurm["idleScript"], standardParallelEnvironment=self.cfg.sge["parallelEnvironment"],
+			     standardQueue=self.cfg.sge["queue"], standardHostSuffix=self.cfg.sge["hostSuffix"],
+			     queueHostsTTL=self.cfg.sge["queueHostsTTL"],
+			     cursorFile=os.path.join(self.cfg.stateDir, "i3sched.sacct"), finishedWindow=self.cfg.slurm["finishedWindow"],
+			     maxArraySize=self.cfg.slurm["maxArraySize"], commandTimeout=self.cfg.timeouts["batchCommand"])
+        except batchErrors, error:
             self.log.writeSchedLog("error", "%s" % error)
             self.log.writeOnedLog("error", "Scheduler stopped: %s" % error)
             sys.exit(1)
@@ -126,39 +224,108 @@ class Scheduler(object):
         
         # start ID for RPC vmpoolinfo
         self.startVMid = self.cfg.oneRPC["startVM"]
+        # highest VM ID seen so far, VMs above are fetched with one open ID range
+        self.highestVMid = self.startVMid - 1
         
         # Host lists
         self.hosts = []
         self.hostIDs = {}
         # only monitored hosts will be used for deployment
-        self.monitoredHosts = [] 
+        self.monitoredHosts = set()
+        # hosts of the batch queue, fetched once per cycle
+        self.queueHosts = frozenset()
 
         # Job lists
         #self.jobs = []
         self.runningJobs = []
         self.pendingJobs = []
         self.finishedJobs = []
+
+        # VM id <-> job id, kept across restarts
+        self.registry = JobRegistry(os.path.join(self.cfg.stateDir, "i3sched.jobs"))
+
+        # index over VMs and jobs of the current cycle
+        self.index = CycleIndex([], [], [], [], self.registry)
+
+        # hosts, vms and jobs are fetched concurrently at the start of each cycle
+        self.loader = SnapshotLoader()
+        self.loader.add("hosts", self.fetchHosts, self.cfg.timeouts["loadHosts"])
+        self.loader.add("vms", self.fetchVMs, self.cfg.timeouts["loadVMs"])
+        self.loader.add("jobs", self.fetchJobs, self.cfg.timeouts["loadJobs"])
+
+        # statistics of the last cycles, see statsHandler
+        self.cycles = CycleHistory(self.cfg.stats["history"])
+        self.statsRequested = False
+        # seconds a cycle may take before its statistics are logged as warning
+        self.cycleBudget = self.cfg.stats["cycleBudget"] or self.sleepTime
+
+        # Prometheus metrics, served over HTTP and/or written to a textfile (None: disabled)
+        self.metrics = None
+        self.metricsFile = self.cfg.metrics["textfile"] or None
+        if self.cfg.metrics["port"] or self.metricsFile is not None:
+            self.metrics = Metrics()
+            self.rpc.observer = self.metrics.observeRPC
+            command.stats.observer = self.metrics.observeCommand
+        if self.cfg.metrics["port"]:
+            try:
+                server = MetricsServer(self.metrics, self.cfg.metrics["address"], self.cfg.metrics["port"])
+                server.start()
+            except socket.error, err:
+                self.log.writeSchedLog("error", "Could not start the metrics endpoint on %s:%s: %s"
+                        % (self.cfg.metrics["address"], self.cfg.metrics["port"], err))
+
+        # VM actions (deploy, shutdown, destroy, delete) run concurrently
+        self.executor = ActionExecutor(workers=self.cfg.actions["workers"],
+                limits=dict((action, self.cfg.actions[action]) for action in ("deploy", "shutdown", "destroy", "delete")))
         
     def signalHandler(self, signal, frame):
         """signal handler for controlled shutdown"""
         self.done = True
+
+    def reopenHandler(self, signal, frame):
+        """signal handler for log rotation, the log files are reopened"""
+        self.log.reopen()
     
-    def loadHosts(self):
-        """loadHosts loads the OneHosts through OneRPC and sets a hostIDs dict up.
-        Catches no exceptions!
+    def fetchHosts(self):
+        """fetchHosts fetches the OneHosts and the queue hosts (runs in a snapshot worker)"""
+        with self.cycles.current.phase("loadHosts"):
+            return (tuple(self.rpc.hostpoolInfo()), self.scheduler.getQueueHostSnapshot())
+
+    def fetchVMs(self):
+        """fetchVMs fetches the OneVMs (runs in a snapshot worker)"""
+        with self.cycles.current.phase("loadVMs"):
+            return tuple(self.rpc.vmpoolInfoPaged(self.cfg.oneRPC["vmStateFilter"], startRange=self.startVMid,
+                    pageSize=self.cfg.oneRPC["pageSize"], lastID=self.highestVMid))
+
+    def fetchJobs(self):
+        """fetchJobs reloads the batch jobs (runs in a snapshot worker)"""
+        with self.cycles.current.phase("loadJobs"):
+            self.scheduler.reloadJobs()
+            return (tuple(self.scheduler.getRunningJobs()), tuple(self.scheduler.getPendingJobs()),
+                    tuple(self.scheduler.getFinishedJobs()))
+
+    def loadSnapshot(self):
+        """loadSnapshot fetches hosts, vms and jobs concurrently and loads them.
+        Raises SnapshotError if a source failed or timed out.
         """
+        snapshot = self.loader.load()
+        self.loadHosts(snapshot)
+        self.loadVMs(snapshot)
+        self.loadJobs(snapshot)
+    
+    def loadHosts(self, snapshot):
+        """loadHosts loads the OneHosts of snapshot and sets a hostIDs dict up."""
         
-        self.hosts = []
         self.hostIDs = {}
-        self.monitoredHosts = []
+        self.monitoredHosts = set()
             
-        self.hosts = self.rpc.hostpoolInfo()
+        self.hosts, self.queueHosts = snapshot.hosts
 
         for host in self.hosts:
             fullHostname = host.name + self.cfg.sge["hostSuffix"]
             self.hostIDs[fullHostname] = host.id
-            if (host.state == "monitored" or host.state == "monitoring_monitored") and fullHostname in self.scheduler.getQueueHosts():
-                self.monitoredHosts.append(fullHostname)
+            if (host.state == "monitored" or host.state == "monitoring_monitored") and fullHostname in self.queueHosts:
+                self.monitoredHosts.add(fullHostname)
     
     def hostNameToOneHostID(self, hostName):
         """hostNameToOneHostID() searches for hostName in self.hostIDs
@@ -168,15 +335,15 @@ class Scheduler(object):
         return self.hostIDs[hostName]   
         
     
-    def loadVMs(self):
-        """loadVMs empties all VM lists and refills them through the OneRPC interface"""
+    def loadVMs(self, snapshot):
+        """loadVMs empties all VM lists and refills them from snapshot"""
         self.finishedVMs = []
         self.pendingVMs = []
         self.failedVMs = []        
         self.runningVMs = []
         self.unknownVMs = []
         self.shutdownVMs = []
-        self.vms = self.rpc.vmpoolInfo(startRange=self.startVMid)
+        self.vms = snapshot.vms
         for vm in self.vms:
             if vm.state == "done":
                 self.finishedVMs.append(vm)
@@ -192,83 +359,87 @@ class Scheduler(object):
             elif vm.lcm_state == "shutdown":
                 self.shutdownVMs.append(vm)
 
+            if vm.id > self.highestVMid:
+                self.highestVMid = vm.id
+
    
-    def loadJobs(self):
-        """loadJobs empties all SGE Job lists and refills them with the SGE interface"""
-        self.runningJobs = []
-        self.pendingJobs = []
-        self.finishedJobs = []
-        self.sge.reloadJobs()
-        self.runningJobs = self.sge.getRunningJobs()
-        self.pendingJobs = self.sge.getPendingJobs()
-        self.finishedJobs = self.sge.getFinishedJobs()
+    def loadJobs(self, snapshot):
+        """loadJobs empties all SGE Job lists and refills them from snapshot"""
+        running, pending, finished = snapshot.jobs
+        self.runningJobs = list(running)
+        self.pendingJobs = list(pending)
+        self.finishedJobs = list(finished)
+
+    def buildIndex(self):
+        """buildIndex indexes the loaded VMs and jobs for the reconciliation passes"""
+        self.registry.update(self.runningJobs + self.pendingJobs)
+        self.index = CycleIndex(self.runningVMs, self.pendingVMs, self.runningJobs, self.pendingJobs, self.registry)
 
     def shutdownRunningZombies(self):
         """Check for running VMs without SGE Job. 
         If such a vm is found, let OpenNebula initiate VM shutdown with rpc.vmShutdown.
         """
-        for vm in self.runningVMs:
-            found = False
-            for job in self.runningJobs:
-                if 'one-'+str(vm.id) == job.name:
-                    found = True
-                    break
-            if not found:
-                try:
-                    self.rpc.vmShutdown(vm.id)
-                    self.log.writeSchedLog("debug", "Zombie VM '%s' shutdown initiated" % (vm.name))
-                except OneError, error:
-                    self.log.writeSchedLog("error", "Zombie VM '%s' shutdown not possible: %s" % (vm.name, error))
-                    if (error.error == 2048) or (error.error == "2048"):
-                        self.log.writeSchedLog("error", "Zombie VM '%s' lcm sate: %s" % (vm.name, vm.lcm_state))
-                except OneRPCError, error:
-                    self.log.writeSchedLog("error", "Zombie VM '%s' shutdown not possible: %s" % (vm.name, error))
+        zombies = [vm for vm in self.runningVMs if not vm.id in self.index.runningJobs]
+
+        for vm, error in self.rpcBatches("shutdown", zombies, partial(self.rpc.vmActionBatch, "shutdown"), [vm.id for vm in zombies]):
+            if error is None:
+                self.log.writeSchedLogf("debug", "Zombie VM '%s' shutdown initiated", vm.name)
+            elif isinstance(error, OneError):
+                # an unhealthy oned fails the same way for every VM, these messages are rate limited
+                self.log.writeSchedLogLimited("error", ("zombie shutdown", str(error.error)),
+                        "Zombie VM '%s' shutdown not possible: %s", vm.name, error)
+                if (error.error == 2048) or (error.error == "2048"):
+                    self.log.writeSchedLogLimited("error", ("zombie lcm state", vm.lcm_state),
+                            "Zombie VM '%s' lcm sate: %s", vm.name, vm.lcm_state)
+            else:
+                self.log.writeSchedLogLimited("error", ("zombie shutdown", error.__class__.__name__),
+                        "Zombie VM '%s' shutdown not possible: %s", vm.name, error)
+
+    def rpcBatches(self, action, keys, batchFunction, argsList):
+        """rpcBatches splits argsList into batches of at most batchSize calls.
+        Every batch is one executor action calling batchFunction(batch), which has to return
+        one result (None or an error) per call, see OneRPC.multicall.
+        Returns a list of (key, error) tuples, one per element of keys/argsList.
+        """
+        size = self.cfg.oneRPC["batchSize"]
+        actions = []
+        for start in range(0, len(argsList), size):
+            actions.append((action, keys[start:start+size], batchFunction, (argsList[start:start+size],)))
+
+        self.cycles.current.count("actions.%s" % action, len(argsList))
+        outcome = []
+        for result in self.executor.run(actions):
+            if not result.ok:
+                raise result.error
+            outcome.extend(zip(result.key, result.result))
+        return outcome
 
     def checkShutdownTimeout(self):
         """Check for running VMs with lcm_state shutdown.
         If such a vm is found and it's longer in this state than self.shutdownTimeout seconds,
         ssh destroy it and delete it
         """
+        timedOut = []
         for vm in self.shutdownVMs:
             now = int(time())
-            if not vm.name in self.shutdownVMTime.keys():
+            if not vm.name in self.shutdownVMTime:
                  self.shutdownVMTime[vm.name] = now
              
-            # TODO add shutdown timeout
             if now - self.shutdownVMTime[vm.name] >= self.shutdownTimeout:
-                if vm.hostname is None:
-                    # VM was created with opennebula < 3.4; Don't know the hostname
-                    self.log.writeSchedLog("info", "VM '%s' was created with opennebula < 3.4, can't destroy VM (no hostname)" % vm.name)
-                    continue
-                
-                if not vm.hostname is None:
-                    # Try to destory VM
-                    status, msg = self.sshDestroyVM(vm.name, vm.hostname, vm.history)
-                    if status == False:
-                        self.log.writeSchedLog("error", "VM '%s' was not destroyed (shutdown timeout): %s" % (vm.name, msg))
-                    else:
-                        self.log.writeSchedLog("debug", "VM '%s' was destroyed: shutdown timeout" % vm.name)
-
-                # delete from OpenNebula 
-                # FIXME Only if destruction was successful?
-                if status == True:
-                    try:
-                        self.rpc.vmDelete(vm.id)
-                        self.log.writeSchedLog("debug", "VM '%s' was deleted" % vm.name)
-                    except OneError, error:
-                        self.log.writeSchedLog("error", "VM '%s' was not deleted: %s" % (vm.name, error))
-                    except OneRPCError, error:
-                        self.log.writeSchedLog("error", "VM '%s' was not deleted: %s" % (vm.name, error))
-                    try:
-                        self.runningVMs.remove(vm)
-                    except:
-                        pass
+                timedOut.append(vm)
+
+        self.destroyVMs(timedOut, "shutdown timeout")
     
     def sshDestroyVM(self, name, hostname, history=None):
         """sshDestroyVM destroys a xen vm through ssh"""
+        timeout = self.cfg.timeouts["ssh"]
         try:
-            output = cmd("ssh %s sudo xm destroy %s" % (hostname, name) , shell=True, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError, error:
+            output = runCommand(["ssh", "-o", "BatchMode=yes", "-o", "ConnectTimeout=%i" % timeout,
+                    hostname, "sudo", "xm", "destroy", name], timeout=timeout)
+        except CommandError, error:
+            if error.returncode is None:
+                # timed out, the destroy of this VM is tried again next cycle
+                return (False, error.msg)
             output = error.output
         
         if output.startswith("Error:"):
@@ -280,148 +451,183 @@ class Scheduler(object):
         """Check for VMs with lcm_state unknown.
         If such a vm is found, delete the VM through SSH.
         """
-        for vm in self.unknownVMs:
+        self.destroyVMs(self.unknownVMs, "lcm state unknown")
+
+    def destroyVMs(self, vms, reason):
+        """destroyVMs ssh destroys vms and deletes the destroyed ones from OpenNebula.
+        Destructions run concurrently first, then the deletions.
+        """
+        actions = []
+        for vm in vms:
             if vm.hostname is None:
                 # VM was created with opennebula < 3.4; Don't know the hostname
                 self.log.writeSchedLog("info", "VM '%s' was created with opennebula < 3.4, can't destroy VM (no hostname)" % vm.name)
                 continue
 
-            
             # Try to destory VM
-            if not vm.hostname is None:
-                status, msg = self.sshDestroyVM(vm.name, vm.hostname, vm.history)
-                if status == False:
-                    self.log.writeSchedLog("error", "VM '%s' was not destroyed (lcm state unknown): %s" % (vm.name, msg))
-                else:
-                    self.log.writeSchedLog("debug", "VM '%s' was destroyed: lcm state unknown" % vm.name)
-            
-            # delete from OpenNebula 
-            # FIXME Only if destruction was successful?
-            if status == True:
-                try:
-                    self.rpc.vmDelete(vm.id)
-                    self.log.writeSchedLog("debug", "VM '%s' was deleted" % vm.name)
-                except OneError, error:
-                    self.log.writeSchedLog("error", "VM '%s' was not deleted: %s" % (vm.name, error))
-                except OneRPCError, error:
-                    self.log.writeSchedLog("error", "VM '%s' was not deleted: %s" % (vm.name, error))
-
-                try:
-                    self.runningVMs.remove(vm)
-                except:
-                    pass
+            actions.append(("destroy", vm, self.sshDestroyVM, (vm.name, vm.hostname)))
+
+        self.cycles.current.count("actions.destroy", len(actions))
+        destroyed = []
+        for result in self.executor.run(actions):
+            vm = result.key
+            if not result.ok:
+                raise result.error
+            status, msg = result.result
+            if status == False:
+                self.log.writeSchedLogLimited("error", ("not destroyed", reason),
+                        "VM '%s' was not destroyed (%s): %s", vm.name, reason, msg)
+            else:
+                self.log.writeSchedLogf("debug", "VM '%s' was destroyed: %s", vm.name, reason)
+                destroyed.append(vm)
+
+        # delete from OpenNebula 
+        # FIXME Only if destruction was successful?
+        for vm, error in self.rpcBatches("delete", destroyed, partial(self.rpc.vmActionBatch, "finalize"), [vm.id for vm in destroyed]):
+            if error is None:
+                self.log.writeSchedLogf("debug", "VM '%s' was deleted", vm.name)
+            else:
+                self.log.writeSchedLogLimited("error", ("not deleted", str(getattr(error, "error", error.__class__.__name__))),
+                        "VM '%s' was not deleted: %s", vm.name, error)
+            self.index.vmRemoved(vm)
+
+        if destroyed:
+            removed = set(vm.id for vm in destroyed)
+            self.runningVMs = [vm for vm in self.runningVMs if not vm.id in removed]
 
     def deleteFinishedVMs(self):
         """Checks for SGE Jobs which have no longer a VM (running or pending).
         If such a job is found, it will be deleted.
         """
-        for job in self.runningJobs:
-            found = False
-            for vm in self.runningVMs:
-                if job.name == 'one-'+str(vm.id):
-                    found = True
-                    break
-            
-            if not found:
-                for vm in self.pendingVMs:
-                    if job.name == 'one-'+str(vm.id):
-                        found = True
-                        break
-
-            if not found:
-                try:
-                    self.sge.deleteJob(job.name)
-                    self.log.writeSchedLog("debug", "SGE job '%s' deleted, there was no VM for this job" % job.name)
-                except SGEError, error:
-                    self.log.writeSchedLog("error", "SGE job %s not deleted: %s, there is no VM for this job" % (job.name, error))
+        jobs = [job for job in self.runningJobs if not self.index.hasVM(self.registry.vmID(job))]
+        for job, status, msg in self.deleteJobs(jobs):
+            if status:
+                self.log.writeSchedLogf("debug", "SGE job '%s' deleted, there was no VM for this job", job.name)
+            else:
+                self.log.writeSchedLog("error", "SGE job %s not deleted: %s, there is no VM for this job" % (job.name, msg))
+
+    def deleteJobs(self, jobs):
+        """deletes jobs with as few batch system calls as possible.
+        Returns a list of (job, status, msg) tuples.
+        """
+        if len(jobs) == 0:
+            return []
+        try:
+            self.cycles.current.count("actions.deleteJob", len(jobs))
+            results = self.scheduler.deleteJobs([job.id for job in jobs])
+        except batchErrors, error:
+            return [(job, False, error) for job in jobs]
+        for id, status, msg in results:
+            if status:
+                self.registry.forget(id)
+        return [(job, status, msg) for job, (id, status, msg) in zip(jobs, results)]
 
 
     def deployNewRunningJobs(self):
         """Check for pending VMs with newly running SGE Jobs.
         If such a VM is found, deploy it.
         """
-        for vm in self.pendingVMs[:]:
-            for job in self.runningJobs:
-                if 'one-'+str(vm.id) == job.name:
-                    try:
-                        hostid = self.hostNameToOneHostID(job.hostname)
-                    except KeyError:
-                        self.log.writeSchedLog("error", "VM '%s' NOT deployed on Host %s: could not resolve host id" % (vm.name, job.hostname))
-                        break
-
-                    if not job.hostname in self.monitoredHosts:
-                        try:
-                            self.sge.deleteJob(job.name)
-                        except SGEError:
-                            self.log.writeSchedLog("error", "SGE job % deletion failed: %s" % (job.name, error))
-                        if "CPU" in vm.template:
-                           requestedCPU = vm.template["CPU"]
-                        else:
-                           requestedCPU = None
-                        requestedMemory = vm.template["MEMORY"]
-                        self.log.writeSchedLog("info", "Host %s not monitored => resubmit SGE job '%s' for VM '%s'" % (job.hostname, job.name, vm.name))
-                        try:
-                            self.sge.submitJob(name='one-'+str(vm.id), hosts=self.monitoredHosts, cpu=requestedCPU, memory=requestedMemory)
-                        except SGEError, error:
-                            self.log.writeSchedLog("error", "SGE Job for VM '%s' submittion failed: %s" % (vm.name, error))
-                        break
-
-                    try:
-                        self.rpc.vmDeploy(vm.id, hostid)
-                        self.log.writeSchedLog("debug", "VM '%s' deployed on Host %s" % (vm.name, job.hostname))
-                        self.pendingVMs.remove(vm)
-                        self.runningVMs.append(vm)
-                    except OneError, error:
-                        self.log.writeSchedLog("error", "VM '%s' NOT deployed on Host %s: %s" % (vm.name, job.hostname, error))
-                    except OneRPCError, error:
-                        self.log.writeSchedLog("error", "VM '%s' NOT deployed on Host %s: %s" % (vm.name, job.hostname, error))
-                    break
+        deployments = []
+        resubmits = []
+        for vm in self.pendingVMs:
+            job = self.index.runningJobs.get(vm.id)
+            if job is None:
+                continue
+
+            try:
+                hostid = self.hostNameToOneHostID(job.hostname)
+            except KeyError:
+                self.log.writeSchedLog("error", "VM '%s' NOT deployed on Host %s: could not resolve host id" % (vm.name, job.hostname))
+                continue
+
+            if not job.hostname in self.monitoredHosts:
+                resubmits.append((vm, job))
+                continue
+
+            deployments.append(((vm, job), (vm.id, hostid)))
+
+        if resubmits:
+            # the queue host snapshot may be stale, it is fetched again for the resubmits (once)
+            self.scheduler.invalidateQueueHosts()
+        deleted = self.deleteJobs([resubmit[1] for resubmit in resubmits])
+        for (vm, job), (_, status, msg) in zip(resubmits, deleted):
+            if not status:
+                self.log.writeSchedLog("error", "SGE job %s deletion failed: %s" % (job.name, msg))
+            if "CPU" in vm.template:
+               requestedCPU = vm.template["CPU"]
+            else:
+               requestedCPU = None
+            requestedMemory = vm.template["MEMORY"]
+            self.log.writeSchedLog("info", "Host %s not monitored => resubmit SGE job '%s' for VM '%s'" % (job.hostname, job.name, vm.name))
+            try:
+                self.cycles.current.count("actions.submit", 1)
+                status, msg = self.scheduler.submitJob(name=CycleIndex.jobName(vm.id), hosts=self.monitoredHosts, cpu=requestedCPU, memory=requestedMemory)
+                if status:
+                    self.registry.register(vm.id, msg)
+            except batchErrors, error:
+                self.log.writeSchedLog("error", "SGE Job for VM '%s' submittion failed: %s" % (vm.name, error))
+
+        deployed = set()
+        for (vm, job), error in self.rpcBatches("deploy", [key for key, args in deployments], self.rpc.vmDeployBatch,
+                [args for key, args in deployments]):
+            if error is None:
+                self.log.writeSchedLogf("debug", "VM '%s' deployed on Host %s", vm.name, job.hostname)
+                deployed.add(vm.id)
+                self.index.vmDeployed(vm)
+                self.runningVMs.append(vm)
+            else:
+                self.log.writeSchedLog("error", "VM '%s' NOT deployed on Host %s: %s" % (vm.name, job.hostname, error))
+
+        if deployed:
+            self.pendingVMs = [vm for vm in self.pendingVMs if not vm.id in deployed]
 
     def submitNewVMs(self):
         """Check for pending VMs without SGE Job (pending or running).
         If such a vm is found, submit a SGE Job with the vm's requirements.
+        VMs with the same requirements are submitted together (one job array with Slurm).
         """
-        for vm in self.pendingVMs[:]:
-            found = False
-            for job in self.pendingJobs:
-                if 'one-'+str(vm.id) == job.name:
-                    found = True
-                    break
-            
-            if not found: 
-                for job in self.runningJobs:
-                    if 'one-'+str(vm.id) == job.name:
-                        found = True
-                        break
-
-            if not found:
-                try:
-                    if "CPU" in vm.template:
-                      requestedCPU = vm.template["CPU"]
-                    else:
-                      requestedCPU = None
-                    requestedMemory = vm.template["MEMORY"]
-                    # get a list with all the hostnames
-                    status, msg = self.sge.submitJob(name='one-'+str(vm.id), hosts=self.monitoredHosts, cpu=requestedCPU, memory=requestedMemory)
-                    if status:
-                        self.log.writeSchedLog("debug", "SGE job (id: %s, name: %s) for VM '%s' submitted" % (msg, vm.name, vm.name))
-                    else:
-                        self.log.writeSchedLog("error", "SGE job submission for VM %s failed: %s" % (vm.name, msg))
-                except SGEError, error:
+        groups = OrderedDict()
+        for vm in self.pendingVMs:
+            if not self.index.hasJob(vm.id):
+                if "CPU" in vm.template:
+                  requestedCPU = vm.template["CPU"]
+                else:
+                  requestedCPU = None
+                requestedMemory = vm.template["MEMORY"]
+                groups.setdefault((requestedCPU, requestedMemory), []).append(vm)
+
+        for (requestedCPU, requestedMemory), vms in groups.items():
+            names = dict((CycleIndex.jobName(vm.id), vm) for vm in vms)
+            try:
+                self.cycles.current.count("actions.submit", len(vms))
+                results = self.scheduler.submitJobs(names=[CycleIndex.jobName(vm.id) for vm in vms], hosts=self.monitoredHosts,
+                        cpu=requestedCPU, memory=requestedMemory)
+            except batchErrors, error:
+                for vm in vms:
                     self.log.writeSchedLog("error", "SGE job submission for VM %s failed: %s" % (vm.name, error))
-                    
+                continue
+
+            for name, status, msg in results:
+                vm = names[name]
+                if status:
+                    self.registry.register(vm.id, msg)
+                    self.log.writeSchedLogf("debug", "SGE job (id: %s, name: %s) for VM '%s' submitted", msg, name, vm.name)
+                else:
+                    self.log.writeSchedLog("error", "SGE job submission for VM %s failed: %s" % (vm.name, msg))
 
 
     
     def newStartVM(self):
-        """newStartVM determines new startVMid"""
-        # id list with all finished vm
-        idList = [vm.id for vm in self.finishedVMs]
-        # see http://stackoverflow.com/questions/3149440/python-splitting-list-based-on-missing-numbers-in-a-sequence
-        try:
-            self.startVMid = max([map(itemgetter(1), g) for k, g in groupby(enumerate(idList), lambda (i,x):i-x)][0])
-        except:
-            self.startVMid = 1
+        """newStartVM determines new startVMid.
+        VM IDs only grow and done is a final state, so every VM below the lowest
+        VM which is not done can be skipped.
+        """
+        ids = [vm.id for vm in self.vms if vm.state != "done"]
+        if len(ids) > 0:
+            self.startVMid = min(ids)
+        else:
+            # every VM up to the highest known ID is done
+            self.startVMid = max(self.startVMid, self.highestVMid + 1)
         if self.startVMid < 1:
             self.startVMid = 1
     
@@ -434,61 +640,131 @@ class Scheduler(object):
         # the current scheduling run will be stopped,
         # but the scheduler will continue to run
 
-        # load hosts
-        try:
-            self.loadHosts()
-        except OneRPCError, error:
-            self.log.writeSchedLog("error", "Could not load hosts: %s" % error)
-            return
-        except OneRPCError, error:
-            self.log.writeSchedLog("error", "Could not load hosts: %s" % error)
-            return            
-        
-        # load vms
-        try:
-            self.loadVMs()
-        except OneRPCError, error:
-            self.log.writeSchedLog("error", "Could not load vms: %s" % error)
-            return
-        except OneRPCError, error:
-            self.log.writeSchedLog("error", "Could not load vms: %s" % error)
-            return      
-        
-        # load jobs
+        # every phase is timed in the statistics of the current cycle
+        cycle = self.cycles.current
+
+        # load hosts, vms and jobs
         try:
-            self.loadJobs()
-        except SGEError, error:
-            self.log.writeSchedLog("error", "Could not load SGE jobs: %s" % error)
+            with cycle.phase("load"):
+                self.loadSnapshot()
+        except SnapshotError, error:
+            if isinstance(error.error, Exception) and not isinstance(error.error, (OneError, OneRPCError) + batchErrors):
+                # not an error of OpenNebula or the batch system
+                raise error.error
+            self.log.writeSchedLog("error", "Could not load %s: %s" % (error.source, error.error))
             return
 
-        
-        # Check for running VMs without SGE Job => Shutdown VMs
-        self.shutdownRunningZombies()
-        
-        # Check for VMs with lcm_state unknown => ssh xm destroy (Tell the hypervisor to kill these VMs)
-        self.cancelUnknownVMs()
- 
-        # Check for VMs wuth lcm_state shutdown, if a vm is longer in this state than shutdownTimeout seconds => ssh xm destroy (Tell the hypervisor to kill this VM)
-        self.checkShutdownTimeout()
-        
-        # Check if a pending VM SGE Job is now running => Deploy VM
-        self.deployNewRunningJobs()
-        
-        # Check for finished VMs with running SGE Job => Delete SGE Job
-        self.deleteFinishedVMs()
-        
-        # Check for new pending VMs without SGE Job => Submit SGE Job
-        self.submitNewVMs()
+        # index VMs and jobs for the reconciliation passes
+        with cycle.phase("buildIndex"):
+            self.buildIndex()
+        self.countSnapshot(cycle)
+
+        passes = [
+            # Check for running VMs without SGE Job => Shutdown VMs
+            self.shutdownRunningZombies,
+            # Check for VMs with lcm_state unknown => ssh xm destroy (Tell the hypervisor to kill these VMs)
+            self.cancelUnknownVMs,
+            # Check for VMs wuth lcm_state shutdown, if a vm is longer in this state than shutdownTimeout seconds => ssh xm destroy (Tell the hypervisor to kill this VM)
+            self.checkShutdownTimeout,
+            # Check if a pending VM SGE Job is now running => Deploy VM
+            self.deployNewRunningJobs,
+            # Check for finished VMs with running SGE Job => Delete SGE Job
+            self.deleteFinishedVMs,
+            # Check for new pending VMs without SGE Job => Submit SGE Job
+            self.submitNewVMs,
+            ]
+        for reconcile in passes:
+            actions = cycle.counted("actions.") if self.metrics is not None else None
+            with cycle.phase(reconcile.__name__):
+                reconcile()
+            if actions is not None:
+                self.countPass(cycle, reconcile.__name__, actions)
+
+        # keep the VM <-> job ids for the next start
+        self.registry.save()
+
+        # report the log messages suppressed by the rate limits
+        self.log.summarizeSuppressed()
 
     
+    def countSnapshot(self, cycle):
+        """records the number of hosts, VMs and jobs of the loaded snapshot"""
+        cycle.count("hosts", len(self.hosts))
+        cycle.count("vms", len(self.vms))
+        cycle.count("vms.running", len(self.runningVMs))
+        cycle.count("vms.pending", len(self.pendingVMs))
+        cycle.count("jobs.running", len(self.runningJobs))
+        cycle.count("jobs.pending", len(self.pendingJobs))
+
+        if self.metrics is not None:
+            vms = {}
+            for vm in self.vms:
+                key = (vm.state, vm.lcm_state)
+                vms[key] = vms.get(key, 0) + 1
+            self.metrics.vms.set(vms)
+            self.metrics.jobs.set({("running",): len(self.runningJobs), ("pending",): len(self.pendingJobs),
+                    ("finished",): len(self.finishedJobs)})
+
+    def countPass(self, cycle, name, before):
+        """adds the actions of the reconciliation pass name to the metrics, before are the action counts before the pass"""
+        for key, value in cycle.counted("actions.").items():
+            value -= before.get(key, 0)
+            if value > 0:
+                self.metrics.actions.inc((name, key[len("actions."):]), value)
+
+    def finishCycle(self, cycle):
+        """closes the statistics of cycle, a cycle exceeding cycleBudget seconds is logged"""
+        cycle.finish()
+        if cycle.duration > self.cycleBudget:
+            self.log.writeSchedLogf("warning", lambda: "%s (budget %s sec)" % (cycle.summary(), self.cycleBudget))
+        else:
+            self.log.writeSchedLogf("debug", cycle.summary)
+
+        if self.metrics is not None:
+            self.metrics.cycles.inc()
+            self.metrics.cycleSeconds.observe(cycle.duration)
+            if self.metricsFile is not None:
+                try:
+                    self.metrics.writeTextfile(self.metricsFile)
+                except (IOError, OSError), err:
+                    self.log.writeSchedLogLimited("error", ("metrics textfile", self.metricsFile),
+                            "Could not write the metrics to %s: %s", self.metricsFile, err)
+
+    def statsHandler(self, signal, frame):
+        """signal handler requesting the statistics of the last cycles,
+        they are written by the main loop, the handler must not take the locks of the cycle or the log
+        """
+        self.statsRequested = True
+
+    def writeStats(self):
+        """writes the statistics of the last cycles to the log if they were requested (SIGUSR1)"""
+        if not self.statsRequested:
+            return
+        self.statsRequested = False
+        for cycle in self.cycles.last():
+            self.log.writeSchedLog("info", cycle.summary())
+
+    def pause(self, seconds):
+        """sleeps seconds, statistics requested meanwhile are written right away"""
+        deadline = time() + seconds
+        while not self.done:
+            self.writeStats()
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            # a signal ends the sleep early
+            sleep(remaining)
+
     def run(self):
         """Starts the scheduler and enters the main working loop
         Loop interval time see sleepTime
         """
-        # Capture SIGINT (^c) & SIGTERM and run self.signalHandler
+        # Capture SIGINT (^c) & SIGTERM and run self.signalHandler, SIGHUP reopens the log files
         try:
             signal.signal(signal.SIGINT, self.signalHandler)
             signal.signal(signal.SIGTERM, self.signalHandler)
+            signal.signal(signal.SIGHUP, self.reopenHandler)
+            signal.signal(signal.SIGUSR1, self.statsHandler)
         except ValueError:
             pass
         
@@ -499,21 +775,26 @@ class Scheduler(object):
         self.log.writeSchedLog("info", "-------------------")
 
         while not self.done:
+            cycle = self.cycles.begin()
 
             # Schedule
             self.schedule()
 
             # Determine VM ID for rpc vmpoolinfo start range
-            self.newStartVM()
+            with cycle.phase("newStartVM"):
+                self.newStartVM()
+
+            self.finishCycle(cycle)
 
-            # Sleep
-            sleep(self.sleepTime)
+            # Sleep, a cycle starts every sleepTime seconds unless the previous one took longer
+            self.pause(self.sleepTime - cycle.duration)
 
         # TODO Clean up & save
         
         self.log.writeSchedLog("info", "-------------------")
         self.log.writeSchedLog("info", "i3sched was stopped")
         self.log.writeSchedLog("info", "-------------------")
+        self.log.flush()
     
     @classmethod
     def createConfig(cls):
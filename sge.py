@@ -1,9 +1,16 @@
 import os
-from subprocess import check_output as cmd
-from subprocess import CalledProcessError
-from subprocess import STDOUT
+import re
 
-import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from time import time
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from batch import QueueHostCache, chunkArgs
+from command import runCommand, CommandStream
 
 class SGEError(Exception):
     def __init__(self, msg):
@@ -18,27 +25,42 @@ class SGE(object):
     qdel = "qdel"
     qhost = "qhost"
     
-    idleCmd = "echo '/bin/sleep 3144960000'"
+    idleScript = "/bin/sleep 3144960000"
     
     standardParallelEnvironment = "shm"
     standardQueue = "on.q"
     standardHostSuffix = ".informatik.uni-erlangen.de"
 
     def __init__(self, qsub="qsub", qstat="qstat",
-            qdel="qdel", qhost="qhost", idleCmd="echo '/bin/sleep 3144960000'",
+            qdel="qdel", qhost="qhost", idleScript="/bin/sleep 3144960000",
             standardParallelEnvironment = "shm",
-            standardQueue = "on.q", standardHostSuffix=".informatik.uni-erlangen.de"):
+            standardQueue = "on.q", standardHostSuffix=".informatik.uni-erlangen.de",
+            queueHostsTTL=0, commandTimeout=None, finishedJobs="diff", zombieSweep=0, finishedWindow=1000):
         
         self.qsub = qsub
         self.qstat = qstat
         self.qdel = qdel
         self.qhost = qhost
 
-        self.idleCmd = idleCmd
+        self.idleScript = idleScript
+        # seconds a qstat/qsub/qdel/qhost call may take
+        self.commandTimeout = commandTimeout
         
         self.standardParallelEnvironment = standardParallelEnvironment
         self.standardQueue = standardQueue
         self.standardHostSuffix = standardHostSuffix
+
+        # queue host snapshots, kept for queueHostsTTL seconds
+        self.queueHostCache = QueueHostCache(self.getQueueHosts, queueHostsTTL)
+
+        # finished jobs are listed by qstat -s z ("qstat") or inferred from the jobs
+        # which left the running/pending lists ("diff"), with a qstat -s z sweep every zombieSweep seconds
+        self.finishedMode = finishedJobs
+        self.zombieSweep = zombieSweep
+        self.lastSweep = 0
+        self.finishedWindow = finishedWindow
+        self.listedJobs = {}
+        self.finished = OrderedDict()
                 
         self.jobs = []
         self.runningJobs = []
@@ -47,6 +69,14 @@ class SGE(object):
         self.finishedJobs = []       
         self._receiveJobs()
     
+    def run(self, argv, input=None):
+        """runs a SGE command, raises SGEError if it fails"""
+        return runCommand(argv, input=input, timeout=self.commandTimeout, errorClass=SGEError)
+
+    def stream(self, argv):
+        """streams the output of a SGE command, raises SGEError if it fails"""
+        return CommandStream(argv, timeout=self.commandTimeout, errorClass=SGEError)
+
     def reloadJobs(self):
         self.jobs = []
         self.runningJobs = []
@@ -56,90 +86,86 @@ class SGE(object):
         self._receiveJobs()
     
     def _receiveJobs(self):
-        try:
-            runningPending = cmd("%s -xml" % self.qstat, shell=True, stderr=STDOUT)
-            finished = cmd("%s -s z -xml" % self.qstat, shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qstat command \"%s\" not found" % self.qstat)
-        except CalledProcessError, error:
-            raise SGEError("qstat failed: could not receive SGE jobs: %s" % error.output.strip())
-
-        xmlRunningPending = ET.fromstring(runningPending)
-        xmlFinished = ET.fromstring(finished)
-
-        # running jobs
-        running = xmlRunningPending.find("queue_info").findall("job_list")
-        # pending jobs
-        pending = xmlRunningPending.find("job_info").findall("job_list")
-        # finished jobs
-        finished = xmlFinished.find("job_info").findall("job_list")
+        # the jobs are parsed while qstat writes them
+        with self.stream([self.qstat, "-xml"]) as output:
+            for section, xmlJob in self.iterJobs(output):
+                job = SGEJob(xmlJob)
+                if section == "queue_info":
+                    # running jobs
+                    self.jobs.append(job)
+                    if job.state == "running":
+                        self.runningJobs.append(job)
+                    elif job.state == "deleted":
+                        self.deletedJobs.append(job)
+                elif section == "job_info":
+                    # pending jobs
+                    self.jobs.append(job)
+                    self.pendingJobs.append(job)
 
-        
-
-        for xmlJob in running:
-            job = Job(xmlJob)
-            self.jobs.append(job)
-            if job.state == "running":
-                self.runningJobs.append(job)
-            elif job.state == "deleted":
-                self.deletedJobs.append(job)
-
-        for xmlJob in pending:
-            job = Job(xmlJob)
-            self.jobs.append(job)
-            self.pendingJobs.append(job)
-
-        for xmlJob in finished:
-            job = Job(xmlJob)
-            self.jobs.append(job)
-            self.finishedJobs.append(job)
-
-
-    def _receiveJobsString(self):
-        try:
-            runningPending = cmd(self.qstat, shell=True, stderr=STDOUT)
-            finished = cmd("%s -s z" % self.qstat, shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qstat command \"%s\" not found" % self.qstat)
-        except CalledProcessError, error:
-            raise SGEError("qstat failed: could not receive SGE jobs: %s", error.output.strip())
-       
-        runningPendingLines = runningPending.strip().split("\n")
-        del runningPendingLines[0:2]
-        
-        finishedLines = finished.strip().split("\n")
-        del finishedLines[0:2]
-        
-        for line in runningPendingLines:
-            data = line.strip().split(" ")
-            data = filter(None, data)
-            job = Job(data)
-            self.jobs.append(job)
-            if job.state == "running":
-                self.runningJobs.append(job)
-            elif job.state == "pending":
-                self.pendingJobs.append(job)
-            elif job.state == "deleted":
-                self.deletedJobs.append(job)
-
-        for line in finishedLines:
-            data = line.strip().split(" ")
-            data = filter(None, data)
-            job = Job(data)
-            job.state = "finished"
-            self.jobs.append(job)
-            self.finishedJobs.append(job)
+        # finished jobs
+        if self.finishedMode == "qstat":
+            self.finishedJobs = self._receiveZombies()
+        else:
+            self._diffFinishedJobs()
+        self.jobs.extend(self.finishedJobs)
+
+    def _receiveZombies(self):
+        """returns the finished jobs listed by qstat -s z"""
+        zombies = []
+        with self.stream([self.qstat, "-s", "z", "-xml"]) as output:
+            for section, xmlJob in self.iterJobs(output):
+                if section == "job_info":
+                    job = SGEJob(xmlJob)
+                    job.state = "finished"
+                    zombies.append(job)
+        return zombies
+
+    def _diffFinishedJobs(self):
+        """infers the finished jobs from the jobs listed by the previous qstat, which are gone now.
+        The last finishedWindow finished jobs are kept.
+        """
+        listed = dict((job.id, job) for job in self.jobs)
+        for id, job in self.listedJobs.items():
+            if not id in listed:
+                job.state = "finished"
+                self.addFinished(job)
+        self.listedJobs = listed
+
+        if self.zombieSweep > 0 and time() - self.lastSweep >= self.zombieSweep:
+            for job in self._receiveZombies():
+                self.addFinished(job)
+            self.lastSweep = time()
+
+        self.finishedJobs = list(self.finished.values())
+
+    def addFinished(self, job):
+        self.finished.pop(job.id, None)
+        self.finished[job.id] = job
+        while len(self.finished) > self.finishedWindow:
+            self.finished.popitem(last=False)
+
+    @staticmethod
+    def iterJobs(output):
+        """yields (section, job_list element) tuples of qstat -xml output read from the file object output.
+        section is queue_info (running jobs) or job_info (pending jobs), the document root is not a section.
+        The output is parsed incrementally and every job element is cleared after use.
+        """
+        sections = []
+        for event, element in ET.iterparse(output, events=("start", "end")):
+            if element.tag in ("queue_info", "job_info"):
+                if event == "start":
+                    sections.append(element.tag)
+                else:
+                    sections.pop()
+            elif event == "end" and element.tag == "job_list":
+                yield (sections[-1] if len(sections) > 1 else None), element
+                element.clear()
 
     def getQueueHosts(self, requiredQueue=None):
         if requiredQueue is None:
              requiredQueue = self.standardQueue
         
-        try:
-            output = cmd("%s -q -xml" % (self.qhost), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qhost command \"%s\" not found" % self.qhost)
-        except CalledProcessError, error:
-            raise SGEError("qhost failed: %s" % error.output.strip())
+        output = self.run([self.qhost, "-q", "-xml"])
         
         agreedHosts = []
 
@@ -154,6 +180,16 @@ class SGE(object):
 
         return(agreedHosts)
 
+    def getQueueHostSnapshot(self, requiredQueue=None):
+        """returns a QueueHosts snapshot of requiredQueue, cached for queueHostsTTL seconds"""
+        if requiredQueue is None:
+             requiredQueue = self.standardQueue
+        return self.queueHostCache.get(requiredQueue)
+
+    def invalidateQueueHosts(self):
+        """forces the next getQueueHostSnapshot to run qhost again"""
+        self.queueHostCache.invalidate()
+
 
 
     def getAllJobs(self):
@@ -168,6 +204,19 @@ class SGE(object):
     def getFinishedJobs(self):
         return self.finishedJobs
 
+    def submitJobs(self, names, hosts=[], queue=None, memory=None, cpu=None, stdout="/dev/null", stderr="/dev/null"):
+        """submits one job for each of names, all with the same requirements.
+        Returns a list of (name, status, jobId or output) tuples.
+        """
+        results = []
+        for name in names:
+            try:
+                status, msg = self.submitJob(name, hosts, queue, memory=memory, cpu=cpu, stdout=stdout, stderr=stderr)
+            except SGEError, error:
+                status, msg = False, error
+            results.append((name, status, msg))
+        return results
+
     def submitJob(self, name, hosts=[], queue=None, hostSuffix=None, memory=None, cpu=None, parallelEnvironment=None, stdout="/dev/null", stderr="/dev/null"):
         if queue is None:
             queue = self.standardQueue
@@ -181,26 +230,19 @@ class SGE(object):
         else:
             #assembledQueue = ",".join([queue+"@"+host+hostSuffix for host in hosts])
             # host have to be complete
-            assembledQueue = ",".join([queue+"@"+host for host in hosts])
-        if memory is None:
-            memory = ""
-        else:
-            #memory = "-l mem_total=%sM" % memory
-            memory = "-l mem_free=%sM" % memory
+            assembledQueue = ",".join([queue+"@"+host for host in sorted(hosts)])
+        qsubArgs = ["-N", name, "-q", assembledQueue]
+        if memory is not None:
+            #qsubArgs += ["-l", "mem_total=%sM" % memory]
+            qsubArgs += ["-l", "mem_free=%sM" % memory]
         
-        if cpu is None:
-            cpu = ""
-        else:
-            cpu = "-pe %s %s" % (parallelEnvironment,cpu)
+        if cpu is not None:
+            qsubArgs += ["-pe", parallelEnvironment, str(cpu)]
 
-        qsubArgs = "-N \"%s\" -q %s %s %s -o %s -e %s" % (name, assembledQueue, memory, cpu, stdout, stderr)
+        qsubArgs += ["-o", stdout, "-e", stderr]
         
-        try:
-            output = cmd("%s | %s %s" % (self.idleCmd, self.qsub, qsubArgs), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qsub command \"%s\" not found" % self.qsub)
-        except CalledProcessError, error:
-            raise SGEError("qsub failed: %s" % error.output.strip())
+        # the job script is read from stdin
+        output = self.run([self.qsub] + qsubArgs, input="%s\n" % self.idleScript)
 
         output = output.strip()
         if output.endswith("has been submitted"):
@@ -219,12 +261,7 @@ class SGE(object):
         else:
             delete = name
             
-        try:
-            output = cmd("%s \"%s\"" % (self.qdel, delete), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qdel command \"%s\" not found" % self.qdel)
-        except CalledProcessError, error:
-            raise SGEError("qdel failed: %s" % error.output.strip())
+        output = self.run([self.qdel, delete])
 
         output = output.strip()
         if output.endswith("for deletion"):
@@ -233,6 +270,40 @@ class SGE(object):
         else:
             return (False, output)
 
+    # qdel reports every job on its own line, e.g. 'user has registered the job 42 for deletion'
+    # or 'denied: job "42" does not exist'
+    qdelJobPattern = re.compile(r'job "?(\d+)"?')
+
+    def deleteJobs(self, ids):
+        """deletes the jobs ids with as few qdel calls as possible.
+        Returns a list of (id, status, output) tuples in the order of ids.
+        """
+        outputs = {}
+        for chunk in chunkArgs(ids):
+            try:
+                output = self.run([self.qdel] + chunk)
+            except SGEError, error:
+                if error.returncode is None:
+                    raise
+                # qdel fails if one of the jobs could not be deleted, the others are reported anyway
+                output = error.output
+
+            for line in output.split("\n"):
+                match = self.qdelJobPattern.search(line)
+                if match is not None:
+                    outputs[match.group(1)] = line.strip()
+
+        results = []
+        for id in ids:
+            output = outputs.get(str(id))
+            if output is None:
+                results.append((id, False, "qdel did not report job %s" % id))
+            elif output.endswith("for deletion") or "has deleted job" in output:
+                results.append((id, True, output))
+            else:
+                results.append((id, False, output))
+        return results
+
 class JobString(object):
     def __init__(self, jobData):        
         self.id = jobData[0]
@@ -257,9 +328,12 @@ class JobString(object):
         self.slots = jobData[-1]
 
 class SGEJob(object):
+    __slots__ = ("id", "priority", "name", "username", "state", "submitTime", "startTime",
+            "qname", "hostname", "slots")
 
     def __init__(self, jobXML):
         state = jobXML.get("state")
+        self.state = None
         
         self.id = jobXML.find("JB_job_number").text
         self.priority = jobXML.find("JAT_prio").text
@@ -1,9 +1,13 @@
 import os
-from subprocess import check_output as cmd
-from subprocess import CalledProcessError
-from subprocess import STDOUT
+import re
+import pwd
+import math
 
-import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from datetime import datetime
+
+from batch import QueueHosts, QueueHostCache, chunkArgs
+from command import runCommand, CommandStream
 
 class SlurmError(Exception):
     def __init__(self, msg):
@@ -13,154 +17,145 @@ class SlurmError(Exception):
 
 
 class Slurm(object):
-    qsub = "qsub"
+    sbatch = "sbatch"
     squeue = "squeue"
     sacct = "sacct"
-    qdel = "qdel"
-    qhost = "qhost"
+    scancel = "scancel"
+    sinfo = "sinfo"
     
-    idleCmd = "echo '/bin/sleep 3144960000'"
+    idleScript = "/bin/sleep 3144960000"
+
+    # highest array task index + 1 (MaxArraySize of slurm.conf)
+    maxArraySize = 1001
     
     standardParallelEnvironment = "shm"
     standardQueue = "on.q"
     standardHostSuffix = ".informatik.uni-erlangen.de"
 
-    def __init__(self, qsub="qsub", squeue="squeue", sacct="sacct",
-            qdel="qdel", qhost="qhost", idleCmd="echo '/bin/sleep 3144960000'",
+    def __init__(self, sbatch="sbatch", squeue="squeue", sacct="sacct",
+            scancel="scancel", sinfo="sinfo", idleScript="/bin/sleep 3144960000",
             standardParallelEnvironment = "shm",
-            standardQueue = "on.q", standardHostSuffix=".informatik.uni-erlangen.de"):
+            standardQueue = "on.q", standardHostSuffix=".informatik.uni-erlangen.de",
+            queueHostsTTL=0, cursorFile=None, finishedWindow=1000, maxArraySize=1001, commandTimeout=None):
         
-        self.qsub = qsub
+        self.sbatch = sbatch
         self.squeue = squeue
-        self.qdel = qdel
-        self.qhost = qhost
+        self.scancel = scancel
+        self.sinfo = sinfo
         self.sacct = sacct
 
-        self.idleCmd = idleCmd
+        self.idleScript = idleScript
+        self.maxArraySize = maxArraySize
+        # seconds a squeue/sacct/sbatch/scancel/sinfo call may take
+        self.commandTimeout = commandTimeout
         
         self.standardParallelEnvironment = standardParallelEnvironment
         self.standardQueue = standardQueue
         self.standardHostSuffix = standardHostSuffix
+
+        # jobs are listed for the user running the scheduler
+        self.user = pwd.getpwuid(os.geteuid()).pw_name
+
+        # sacct is only asked for jobs which ended since the last poll
+        self.finishedTracker = FinishedJobTracker(cursorFile, finishedWindow)
+
+        # queue host snapshots, kept for queueHostsTTL seconds
+        self.queueHostCache = QueueHostCache(self.getQueueHosts, queueHostsTTL)
                 
         self.jobs = []
         self.runningJobs = []
         self.pendingJobs = []
+        self.completingJobs = []
         self.deletedJobs = []
         self.finishedJobs = []       
         self._receiveJobs()
     
+    def run(self, argv, input=None):
+        """runs a Slurm command, raises SlurmError if it fails"""
+        return runCommand(argv, input=input, timeout=self.commandTimeout, errorClass=SlurmError)
+
+    def stream(self, argv):
+        """streams the output of a Slurm command, raises SlurmError if it fails"""
+        return CommandStream(argv, timeout=self.commandTimeout, errorClass=SlurmError)
+
     def reloadJobs(self):
         self.jobs = []
         self.runningJobs = []
         self.pendingJobs = []
+        self.completingJobs = []
         self.deletedJobs = []
         self.finishedJobs = []
         self._receiveJobs()
     
     def _receiveJobs(self):
-        try:
-            running = cmd("%s -o '%%i %%P %%j %%u %%t %%M %%D %%R' -h -u `whoami` --states=R,CG" % self.squeue, shell=True, stderr=STDOUT)
-            #finished = cmd("%s -o '%%i %%P %%j %%u %%t %%M %%D %%R' -h -u `whoami` --states=CD,S,CA,F,TO,NF" % self.squeue, shell=True, stderr=STDOUT)
-            finished = cmd("%s -n -o 'jobid,jobname,account,partition,alloccpus,elapsed,state,exitcode'" % self.sacct, shell=True, stderr=STDOUT) 
-            pending = cmd("%s -o '%%i %%P %%j %%u %%t %%M %%D %%R' -h -u `whoami` --states=PD" % self.squeue, shell=True, stderr=STDOUT)
-        except OSError:
-            raise SlurmError("squeue command \"%s\" not found" % self.qstat)
-        except CalledProcessError, error:
-            raise SlurmError("squeue failed: could not receive SGE jobs: %s" % error.output.strip())
-
-        #xmlRunningPending = ET.fromstring(runningPending)
-        #xmlFinished = ET.fromstring(finished)
-
-        # running jobs
-        #running = xmlRunningPending.find("queue_info").findall("job_list")
-        # pending jobs
-        #pending = xmlRunningPending.find("job_info").findall("job_list")
-        # finished jobs
-        #finished = xmlFinished.find("job_info").findall("job_list")
-
-
-        for jobString in running.split('\n'):
-	    if not jobString=='': 
-                job = SlurmJob(jobString)
-                self.jobs.append(job)
-                if job.state == "running":
-                    self.runningJobs.append(job)
-            #elif job.state == "deleted":
-            #    self.deletedJobs.append(job)
-
-        for jobString in pending.split('\n'):
-	    if not jobString=='':
-                job = SlurmJob(jobString)
-                self.jobs.append(job)
+        # one squeue call lists the jobs in all states
+        with self.stream([self.squeue, "--noheader", "--array", "--user=%s" % self.user, "--states=all",
+                "--format=%s" % SlurmJob.squeueFormat]) as queued:
+            for line in queued:
+                job = SlurmJob.fromLine(line, self.standardHostSuffix)
+                if job is not None and job.state != "finished":
+                    self.addJob(job)
+
+        self._receiveFinishedJobs()
+        for job in self.finishedTracker.getJobs():
+            self.addJob(job)
+
+    def _receiveFinishedJobs(self):
+        """asks sacct for the jobs which ended since the cursor of the finished job tracker"""
+        now = datetime.now().strftime(FinishedJobTracker.timeFormat)
+        ended = []
+        with self.stream([self.sacct, "--noheader", "--parsable2", "--allocations", "--user=%s" % self.user,
+                "--state=%s" % FinishedJobTracker.finishedStates, "--starttime=%s" % self.finishedTracker.since(),
+                "--endtime=%s" % now, "--format=%s,end" % SlurmJob.sacctFormat]) as finished:
+            for line in finished:
+                fields = line.strip().rsplit("|", 1)
+                if len(fields) != 2:
+                    continue
+                job = SlurmJob.fromLine(fields[0], self.standardHostSuffix)
+                if job is not None and job.state == "finished":
+                    ended.append((job, fields[1]))
+        self.finishedTracker.update(ended)
+
+    def addJob(self, job):
+        """files job into the job list of its state"""
+        self.jobs.append(job)
+        if job.state == "running":
+            self.runningJobs.append(job)
+        elif job.state == "pending":
+            self.pendingJobs.append(job)
+        elif job.state == "completing":
+            self.completingJobs.append(job)
+        elif job.state == "finished":
+            self.finishedJobs.append(job)
+        elif job.state in ("suspended", "unknown"):
+            # suspended jobs and jobs in a state this version does not know are not gone,
+            # they are kept with the running jobs if they have nodes, else with the pending jobs
+            if job.hostname:
+                self.runningJobs.append(job)
+            else:
                 self.pendingJobs.append(job)
 
-        for jobString in finished.split('\n'):
-	    if not jobString=='':
-                job = SlurmJob(jobString)
-                self.jobs.append(job)
-                self.finishedJobs.append(job)
+    def getNodes(self):
+        """returns a SlurmNodes inventory of all nodes, built from one sinfo call"""
+        output = self.run([self.sinfo, "--noheader", "--Node", "--format=%s" % SlurmNodes.sinfoFormat])
 
-
-    def _receiveJobsString(self):
-        try:
-            runningPending = cmd(self.qstat, shell=True, stderr=STDOUT)
-            finished = cmd("%s -s z" % self.qstat, shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qstat command \"%s\" not found" % self.qstat)
-        except CalledProcessError, error:
-            raise SGEError("qstat failed: could not receive SGE jobs: %s", error.output.strip())
-       
-        runningPendingLines = runningPending.strip().split("\n")
-        del runningPendingLines[0:2]
-        
-        finishedLines = finished.strip().split("\n")
-        del finishedLines[0:2]
-        
-        for line in runningPendingLines:
-            data = line.strip().split(" ")
-            data = filter(None, data)
-            job = Job(data)
-            self.jobs.append(job)
-            if job.state == "running":
-                self.runningJobs.append(job)
-            elif job.state == "pending":
-                self.pendingJobs.append(job)
-            elif job.state == "deleted":
-                self.deletedJobs.append(job)
-
-        for line in finishedLines:
-            data = line.strip().split(" ")
-            data = filter(None, data)
-            job = Job(data)
-            job.state = "finished"
-            self.jobs.append(job)
-            self.finishedJobs.append(job)
+        return SlurmNodes.fromOutput(output, self.standardHostSuffix)
 
     def getQueueHosts(self, requiredQueue=None):
+        """returns a SlurmNodes snapshot with the usable nodes of partition requiredQueue"""
         if requiredQueue is None:
              requiredQueue = self.standardQueue
-        
-        try:
-            output = cmd("%s -q -xml" % (self.qhost), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SlurmError("qhost command \"%s\" not found" % self.qhost)
-        except CalledProcessError, error:
-            raise SlurmError("qhost failed: %s" % error.output.strip())
-        
-        agreedHosts = []
-
-        xml = ET.fromstring(output)
-        hosts = xml.findall("host")
-        for host in hosts:
-            queues = host.findall("queue")
-            for queue in queues:
-                if queue.get("name") == requiredQueue:
-                    agreedHosts.append(host.get("name"))
-                    break
-
-        return(agreedHosts)
+        return self.getNodes().partition(requiredQueue)
 
+    def getQueueHostSnapshot(self, requiredQueue=None):
+        """returns a SlurmNodes snapshot of requiredQueue, cached for queueHostsTTL seconds"""
+        if requiredQueue is None:
+             requiredQueue = self.standardQueue
+        return self.queueHostCache.get(requiredQueue)
 
+    def invalidateQueueHosts(self):
+        """forces the next getQueueHostSnapshot to run sinfo again"""
+        self.queueHostCache.invalidate()
 
     def getAllJobs(self):
         return self.jobs
@@ -171,73 +166,150 @@ class Slurm(object):
     def getRunningJobs(self):
         return self.runningJobs
 
+    def getCompletingJobs(self):
+        return self.completingJobs
+
     def getFinishedJobs(self):
         return self.finishedJobs
 
     def submitJob(self, name, hosts=[], queue=None, hostSuffix=None, memory=None, cpu=None, parallelEnvironment=None, stdout="/dev/null", stderr="/dev/null"):
+        """submits one idle job with sbatch, returns (True, jobId) or (False, output)"""
+        args = ["--job-name=%s" % name] + self._sbatchArgs(hosts, queue, memory, cpu, stdout, stderr)
+        status, output = self._submit(args)
+        if status:
+            return (True, output)
+        return (False, output)
+
+    def submitJobs(self, names, hosts=[], queue=None, memory=None, cpu=None, stdout="/dev/null", stderr="/dev/null"):
+        """submits one idle job for each of names, all with the same requirements.
+        Jobs named one-<vmid> are submitted as job arrays: the array is named one-array-<base>
+        and task <index> runs the job of VM <base + index>, see SlurmJob.
+        Returns a list of (name, status, jobId or output) tuples.
+        """
+        results = []
+        vmids = []
+        for name in names:
+            try:
+                vmids.append(int(name[len("one-"):]) if name.startswith("one-") else None)
+            except ValueError:
+                vmids.append(None)
+
+        for name, vmid in zip(names, vmids):
+            if vmid is None:
+                status, msg = self.submitJob(name, hosts, queue, memory=memory, cpu=cpu, stdout=stdout, stderr=stderr)
+                results.append((name, status, msg))
+
+        args = self._sbatchArgs(hosts, queue, memory, cpu, stdout, stderr)
+        for base, indices in self._arrays(sorted(vmid for vmid in vmids if vmid is not None)):
+            status, output = self._submit(["--job-name=one-array-%i" % base,
+                "--array=%s" % self._arraySpec(indices)] + args)
+            for index in indices:
+                if status:
+                    results.append(("one-%i" % (base + index), True, "%s_%i" % (output, index)))
+                else:
+                    results.append(("one-%i" % (base + index), False, output))
+        return results
+
+    def _arrays(self, vmids):
+        """splits the sorted vmids into arrays, returns (base, task indices) tuples"""
+        arrays = []
+        for vmid in vmids:
+            if len(arrays) == 0 or vmid - arrays[-1][0] >= self.maxArraySize:
+                arrays.append((vmid, []))
+            arrays[-1][1].append(vmid - arrays[-1][0])
+        return arrays
+
+    @staticmethod
+    def _arraySpec(indices):
+        """compresses sorted task indices into an --array range list, e.g. 0-3,7"""
+        ranges = []
+        for index in indices:
+            if ranges and index == ranges[-1][1] + 1:
+                ranges[-1][1] = index
+            else:
+                ranges.append([index, index])
+        return ",".join(str(a) if a == b else "%i-%i" % (a, b) for a, b in ranges)
+
+    def _sbatchArgs(self, hosts, queue, memory, cpu, stdout, stderr):
+        """sbatch arguments for the given requirements"""
         if queue is None:
             queue = self.standardQueue
-        if hostSuffix is None:
-            hostStuffix = self.standardHostSuffix
-        if parallelEnvironment is None:
-            parallelEnvironment = self.standardParallelEnvironment
-
-        if len(hosts) == 0:
-            assembledQueue = queue
-        else:
-            #assembledQueue = ",".join([queue+"@"+host+hostSuffix for host in hosts])
-            # host have to be complete
-            assembledQueue = ",".join([queue+"@"+host for host in hosts])
-        if memory is None:
-            memory = ""
-        else:
-            #memory = "-l mem_total=%sM" % memory
-            memory = "-l mem_free=%sM" % memory
-        
-        if cpu is None:
-            cpu = ""
-        else:
-            cpu = "-pe %s %s" % (parallelEnvironment,cpu)
-
-        qsubArgs = "-N \"%s\" -q %s %s %s -o %s -e %s" % (name, assembledQueue, memory, cpu, stdout, stderr)
-        
-        try:
-            output = cmd("%s | %s %s" % (self.idleCmd, self.qsub, qsubArgs), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qsub command \"%s\" not found" % self.qsub)
-        except CalledProcessError, error:
-            raise SGEError("qsub failed: %s" % error.output.strip())
-
+        args = ["--parsable", "--partition=%s" % queue, "--output=%s" % stdout, "--error=%s" % stderr]
+        if memory is not None:
+            args.append("--mem=%iM" % int(float(memory)))
+        if cpu is not None:
+            args.append("--cpus-per-task=%i" % max(1, int(math.ceil(float(cpu)))))
+
+        # keep the jobs off the nodes of the partition which are not in hosts,
+        # the nodes of the snapshot loaded for the cycle are used, sinfo only runs if there is none
+        if len(hosts) > 0:
+            snapshot = self.queueHostCache.last(queue)
+            if snapshot is None:
+                snapshot = self.getQueueHostSnapshot(queue)
+            nodes = snapshot.nodes
+            excluded = [name for name, node in nodes.items() if queue in node.partitions and not name in hosts]
+            if excluded:
+                suffix = len(self.standardHostSuffix)
+                args.append("--exclude=%s" % ",".join(sorted(name[:len(name) - suffix] if suffix else name for name in excluded)))
+        return args
+
+    def _submit(self, args):
+        """runs sbatch with args and the idle script on stdin, returns (True, jobId) or (False, output)"""
+        output = self.run([self.sbatch] + args, input="#!/bin/sh\n%s\n" % self.idleScript)
+
+        # --parsable prints "jobid" or "jobid;cluster"
         output = output.strip()
-        if output.endswith("has been submitted"):
-            jobId = output.split(" ")[2]
+        jobId = output.split(";")[0]
+        if jobId.isdigit():
             return (True, jobId)
-        else:
-            return (False, output)
+        return (False, output)
 
 
     def deleteJob(self, name="", id=0):
         if id == 0 and name == "":
             return (False, "No ID or name given")
-        
-        if id != 0:
-            delete = str(id)
-        else:
-            delete = name
-            
-        try:
-            output = cmd("%s \"%s\"" % (self.qdel, delete), shell=True, stderr=STDOUT)
-        except OSError:
-            raise SGEError("qdel command \"%s\" not found" % self.qdel)
-        except CalledProcessError, error:
-            raise SGEError("qdel failed: %s" % error.output.strip())
 
-        output = output.strip()
-        if output.endswith("for deletion"):
-            jobId = output.split(" ")[5]
-            return (True, jobId)
+        if id != 0:
+            delete = [str(id)]
         else:
-            return (False, output)
+            delete = ["--user=%s" % self.user, "--name=%s" % name]
+
+        self.run([self.scancel] + delete)
+
+        return (True, str(id) if id != 0 else name)
+
+    # scancel is silent for cancelled jobs and reports the others,
+    # e.g. 'scancel: error: Kill job error on job id 42: Invalid job id specified'
+    scancelJobPattern = re.compile(r"job id (\S+?):")
+
+    def deleteJobs(self, ids):
+        """cancels the jobs ids (array tasks as <jobid>_<index>) with as few scancel calls as possible.
+        Returns a list of (id, status, output) tuples in the order of ids.
+        """
+        errors = {}
+        for chunk in chunkArgs(ids):
+            try:
+                self.run([self.scancel] + chunk)
+            except SlurmError, error:
+                if error.returncode is None:
+                    raise
+                reported = False
+                for line in error.output.split("\n"):
+                    match = self.scancelJobPattern.search(line)
+                    if match is not None:
+                        errors[match.group(1)] = line.strip()
+                        reported = True
+                if not reported:
+                    for id in chunk:
+                        errors[id] = "scancel failed: %s" % error.output.strip()
+
+        results = []
+        for id in ids:
+            if str(id) in errors:
+                results.append((id, False, errors[str(id)]))
+            else:
+                results.append((id, True, str(id)))
+        return results
 
 class JobString(object):
     def __init__(self, jobData):        
@@ -262,46 +334,208 @@ class JobString(object):
         
         self.slots = jobData[-1]
 
-class SlurmJob(object):
-
-    def __init__(self, jobString):
-        print "jobString: "+jobString
-        fields = jobString.split()
+class SlurmNode(object):
+    """SlurmNode is one node of the sinfo output"""
+    __slots__ = ("name", "partitions", "state", "freeCPU", "freeMemory")
+
+    def __init__(self, name, state, freeCPU, freeMemory):
+        self.name = name
+        self.partitions = set()
+        self.state = state
+        self.freeCPU = freeCPU
+        self.freeMemory = freeMemory
+
+class SlurmNodes(QueueHosts):
+    """SlurmNodes is a snapshot of the Slurm nodes.
+    nodes maps the full hostnames (node name and host suffix) to SlurmNodes,
+    membership checks are set lookups over the usable nodes of queue (all partitions if None).
+    """
+
+    # node name, partition, state, cpus (allocated/idle/other/total), free memory in MB
+    sinfoFormat = "%N|%P|%T|%C|%e"
+
+    # nodes in these states take new jobs
+    usableStates = set(["idle", "mixed", "allocated", "completing"])
+
+    def __init__(self, nodes, queue=None):
+        self.nodes = nodes
+        usable = [name for name, node in nodes.items()
+                if node.state in self.usableStates and (queue is None or queue in node.partitions)]
+        QueueHosts.__init__(self, usable, queue)
+
+    @classmethod
+    def fromOutput(cls, output, hostSuffix=""):
+        """builds the inventory from the sinfo output, nodes are listed once per partition"""
+        nodes = {}
+        for line in output.split("\n"):
+            fields = line.strip().split("|")
+            if len(fields) != 5:
+                continue
+            name, partition, state, cpus, freeMemory = fields
+
+            name = name + hostSuffix
+            node = nodes.get(name)
+            if node is None:
+                # flags like "*" (not responding) or "~" (powered off) are appended to the state
+                state = state.rstrip("*~#!%$@^-+")
+                try:
+                    freeCPU = int(cpus.split("/")[1])
+                except (IndexError, ValueError):
+                    freeCPU = None
+                try:
+                    freeMemory = int(freeMemory)
+                except ValueError:
+                    freeMemory = None
+                node = SlurmNode(name, state, freeCPU, freeMemory)
+                nodes[name] = node
+
+            # the default partition is marked with "*"
+            node.partitions.add(partition.rstrip("*"))
+        return cls(nodes)
+
+    def partition(self, queue):
+        """returns a snapshot of the same nodes restricted to partition queue"""
+        return SlurmNodes(self.nodes, queue)
+
+class FinishedJobTracker(object):
+    """FinishedJobTracker remembers the end time of the latest finished job (the cursor)
+    and keeps the last window finished jobs in memory.
+    The cursor is written to cursorFile, so a restarted scheduler does not read the
+    whole accounting history again.
+    """
+
+    # sacct time format
+    timeFormat = "%Y-%m-%dT%H:%M:%S"
+
+    # states of finished jobs
+    finishedStates = "CD,CA,F,TO,NF,PR,BF,DL,OOM,RV"
+
+    def __init__(self, cursorFile=None, window=1000):
+        self.cursorFile = cursorFile
+        self.window = window
+        self.jobs = OrderedDict()
+        self.cursor = self.readCursor()
+
+    def readCursor(self):
+        if self.cursorFile is None:
+            return None
+        try:
+            with open(self.cursorFile) as f:
+                cursor = f.readline().strip()
+            datetime.strptime(cursor, self.timeFormat)
+            return cursor
+        except (IOError, ValueError):
+            return None
+
+    def writeCursor(self):
+        if self.cursorFile is None or self.cursor is None:
+            return
+        # the cursor is only an optimization, if it can't be written it is kept in memory
+        try:
+            tmpFile = self.cursorFile + ".tmp"
+            with open(tmpFile, "w") as f:
+                f.write(self.cursor + "\n")
+            os.rename(tmpFile, self.cursorFile)
+        except (IOError, OSError):
+            pass
+
+    def since(self):
+        """start time for sacct, the cursor or the start of the current day"""
+        if self.cursor is None:
+            return datetime.now().strftime("%Y-%m-%dT00:00:00")
+        return self.cursor
+
+    def update(self, ended):
+        """adds the finished jobs of ended, a list of (job, end time) tuples, and moves the cursor"""
+        cursor = self.cursor
+        for job, end in ended:
+            self.jobs.pop(job.id, None)
+            self.jobs[job.id] = job
+            try:
+                datetime.strptime(end, self.timeFormat)
+            except ValueError:
+                continue
+            if cursor is None or end > cursor:
+                cursor = end
+
+        while len(self.jobs) > self.window:
+            self.jobs.popitem(last=False)
+
+        if cursor != self.cursor:
+            self.cursor = cursor
+            self.writeCursor()
+
+    def getJobs(self):
+        return self.jobs.values()
 
-        #state = fields[4]
-        
-        self.id = fields[0]
-        self.name = fields[2]
-        #self.username = fields[3]
-	#finishedStates = ["CD","S","CA","F","TO","NF"]
-	#runningStates = ["R","CG"]
-	#pendingStates = ["PD"]
-        #if state in runningStates:
-	#    self.state = "running"            
-        #elif state in pendingStates:
-        #    self.state = "pending"
-        #elif state in finishedStates:
-        #    self.state = "finished"
-        
-        #try:
-        #    self.submitTime = jobXML.find("JB_submission_time").text.replace("T", " ")
-        #except:
-        #    self.submitTime = ""
-        #try:
-        #    self.startTime = jobXML.find("JAT_start_time").text.replace("T", " ")
-        #except:
-        #    self.startTime = ""
-
-        #self.runTime = fields[5]
-        #self.partition = fields[2]
-        #if not fields[7].startswith("("):
-        #  self.hostname = fields[7]
-	#else:
-	#  self.hostname = ""
-        #if jobXML.find("queue_name").text is None:
-        #    self.qname = ""
-        #    self.hostname = ""
-        #else:    
-        #    self.qname, self.hostname = jobXML.find("queue_name").text.split("@")
-        
-        #self.slots = jobXML.find("slots").text
+class SlurmJob(object):
+    """SlurmJob is a job listed by squeue or sacct.
+    Both are called with squeueFormat/sacctFormat, the fields are separated by "|":
+    job id, job name, state and node list.
+    """
+    __slots__ = ("id", "name", "state", "hostname")
+
+    squeueFormat = "%i|%j|%t|%N"
+    sacctFormat = "jobid,jobname,state,nodelist"
+
+    # squeue state codes and sacct state names, only the terminal states are "finished",
+    # any other state is "unknown" and the job is kept (see Slurm.addJob)
+    states = {
+            "PD": "pending", "PENDING": "pending",
+            "CF": "pending", "CONFIGURING": "pending",
+            # requeued or held jobs are pending again
+            "RQ": "pending", "REQUEUED": "pending",
+            "RF": "pending", "REQUEUE_FED": "pending",
+            "RH": "pending", "REQUEUE_HOLD": "pending",
+            "RD": "pending", "RESV_DEL_HOLD": "pending",
+            "SE": "pending", "SPECIAL_EXIT": "pending",
+            "R": "running", "RUNNING": "running",
+            "SI": "running", "SIGNALING": "running",
+            "RS": "running", "RESIZING": "running",
+            "CG": "completing", "COMPLETING": "completing",
+            "SO": "completing", "STAGE_OUT": "completing",
+            "S": "suspended", "SUSPENDED": "suspended",
+            "ST": "suspended", "STOPPED": "suspended",
+            "CD": "finished", "COMPLETED": "finished",
+            "CA": "finished", "CANCELLED": "finished",
+            "F": "finished", "FAILED": "finished",
+            "TO": "finished", "TIMEOUT": "finished",
+            "NF": "finished", "NODE_FAIL": "finished",
+            "PR": "finished", "PREEMPTED": "finished",
+            "BF": "finished", "BOOT_FAIL": "finished",
+            "DL": "finished", "DEADLINE": "finished",
+            "OOM": "finished", "OUT_OF_MEMORY": "finished",
+            "RV": "finished", "REVOKED": "finished"
+            }
+
+    def __init__(self, fields, hostSuffix=""):
+        self.id, self.name, state, nodes = fields
+
+        # tasks of the job arrays of Slurm.submitJobs run the VM base + task index
+        if self.name.startswith("one-array-") and "_" in self.id:
+            try:
+                self.name = "one-%i" % (int(self.name[len("one-array-"):]) + int(self.id.split("_", 1)[1]))
+            except ValueError:
+                pass
+
+        # sacct appends details to some states, e.g. "CANCELLED by 1000"
+        state = state.split(" ")[0]
+        self.state = self.states.get(state, "unknown")
+
+        # node names of pending jobs are empty, sacct reports "None assigned"
+        if nodes == "" or " " in nodes:
+            self.hostname = ""
+        else:
+            self.hostname = nodes + hostSuffix
+
+    @classmethod
+    def fromLine(cls, line, hostSuffix=""):
+        """returns the SlurmJob of an output line or None if the line is no job"""
+        fields = line.strip().split("|", 1)
+        if len(fields) != 2:
+            return None
+        # the job name may contain the delimiter
+        rest = fields[1].rsplit("|", 2)
+        if len(rest) != 3:
+            return None
+        return cls([fields[0]] + rest, hostSuffix)
@@ -0,0 +1,102 @@
+# This file provides the concurrent snapshot loader.
+# Hosts, VMs and batch jobs are fetched in parallel worker threads,
+# the results are combined into one immutable CycleSnapshot.
+
+import threading
+
+from time import time
+
+class SnapshotError(Exception):
+    def __init__(self, source, error):
+        self.source = source
+        self.error = error
+    def __str__(self):
+        return repr("%s: %s" % (self.source, self.error))
+
+class CycleSnapshot(object):
+    """CycleSnapshot holds the results of all sources of one scheduling cycle.
+    Every source result is an attribute named like the source.
+    Attributes can not be changed after construction.
+    """
+
+    def __init__(self, results):
+        self.__dict__.update(results)
+        self.__dict__["time"] = time()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CycleSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CycleSnapshot is immutable")
+
+class SnapshotWorker(threading.Thread):
+    """SnapshotWorker runs the fetch function of one source"""
+
+    def __init__(self, name, fetch):
+        threading.Thread.__init__(self, name="snapshot-%s" % name)
+        self.daemon = True
+        self.source = name
+        self.fetch = fetch
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fetch()
+        except Exception, error:
+            self.error = error
+
+class SnapshotLoader(object):
+    """SnapshotLoader fetches all registered sources concurrently.
+    Each source has a timeout in seconds (None: wait forever).
+    load() raises SnapshotError for the first failed source (in registration order),
+    so the caller can abort the current cycle.
+    """
+
+    def __init__(self):
+        self.sources = []
+        # workers which did not finish in time, a source is not fetched again while they run
+        self.busy = {}
+
+    def add(self, name, fetch, timeout=None):
+        """registers source name, fetch() is called in a worker thread and returns its result"""
+        self.sources.append((name, fetch, timeout))
+
+    def load(self):
+        workers = []
+        for name, fetch, timeout in self.sources:
+            if name in self.busy and self.busy[name].is_alive():
+                workers.append((name, None, timeout))
+                continue
+            self.busy.pop(name, None)
+            worker = SnapshotWorker(name, fetch)
+            worker.start()
+            workers.append((name, worker, timeout))
+
+        start = time()
+        results = {}
+        failed = None
+        for name, worker, timeout in workers:
+            if worker is None:
+                if failed is None:
+                    failed = SnapshotError(name, "still running since a previous cycle")
+                continue
+
+            if timeout is None:
+                worker.join()
+            else:
+                worker.join(max(0, start + timeout - time()))
+
+            if worker.is_alive():
+                self.busy[name] = worker
+                if failed is None:
+                    failed = SnapshotError(name, "timed out after %s sec" % timeout)
+            elif worker.error is not None:
+                if failed is None:
+                    failed = SnapshotError(name, worker.error)
+            else:
+                results[name] = worker.result
+
+        if failed is not None:
+            raise failed
+        return CycleSnapshot(results)
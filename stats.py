@@ -0,0 +1,91 @@
+# This file provides the cycle statistics.
+# Every scheduling cycle records the wall time and number of calls of its phases
+# and counts (VMs, jobs, actions), the last cycles are kept in a ring buffer.
+
+import threading
+
+from collections import deque
+from time import time
+
+class CycleStats(object):
+    """CycleStats holds the phase timings and counts of one scheduling cycle.
+    Phases may be recorded by several threads (the snapshot workers).
+    """
+
+    def __init__(self, number):
+        self.number = number
+        self.start = time()
+        self.duration = None
+        # phase -> [seconds, calls], in the order the phases were first entered
+        self.phases = {}
+        self.order = []
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        """context manager timing phase name"""
+        return PhaseTimer(self, name)
+
+    def record(self, name, seconds):
+        with self.lock:
+            phase = self.phases.get(name)
+            if phase is None:
+                phase = self.phases[name] = [0.0, 0]
+                self.order.append(name)
+            phase[0] += seconds
+            phase[1] += 1
+
+    def count(self, name, value):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def counted(self, prefix=""):
+        """returns a copy of the counts whose names start with prefix"""
+        with self.lock:
+            return dict((name, value) for name, value in self.counts.items() if name.startswith(prefix))
+
+    def finish(self):
+        self.duration = time() - self.start
+
+    def summary(self):
+        """one line with the duration, the phases (seconds/calls) and the counts"""
+        with self.lock:
+            phases = ", ".join("%s %.3fs/%i" % (name, self.phases[name][0], self.phases[name][1]) for name in self.order)
+            counts = ", ".join("%s %i" % (name, value) for name, value in sorted(self.counts.items()))
+        duration = self.duration if self.duration is not None else time() - self.start
+        return "cycle %i took %.3f sec: %s; %s" % (self.number, duration, phases, counts)
+
+class PhaseTimer(object):
+    def __init__(self, cycle, name):
+        self.cycle = cycle
+        self.name = name
+
+    def __enter__(self):
+        self.start = time()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.cycle.record(self.name, time() - self.start)
+        return False
+
+class CycleHistory(object):
+    """CycleHistory keeps the CycleStats of the last size cycles"""
+
+    def __init__(self, size=100):
+        self.cycles = deque(maxlen=size)
+        self.number = 0
+        self.current = CycleStats(0)
+
+    def begin(self):
+        """starts the statistics of a new cycle, it becomes current"""
+        self.number += 1
+        self.current = CycleStats(self.number)
+        self.cycles.append(self.current)
+        return self.current
+
+    def last(self, n=None):
+        """returns the last n (all) cycles, oldest first"""
+        cycles = list(self.cycles)
+        if n is not None:
+            cycles = cycles[-n:]
+        return cycles
@@ -0,0 +1,35 @@
+# Fake batch system commands for the tests.
+# A fake command prints captured output and exits with a given code,
+# so the parsers are tested without a live batch system.
+
+import os
+import shutil
+import tempfile
+
+class FakeCommands(object):
+    """FakeCommands writes fake commands into a temporary directory"""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="i3sched-test-")
+
+    def add(self, name, output="", returncode=0):
+        """creates the command name printing output, returns its path.
+        Every call appends its arguments to <path>.calls, stdin is kept in <path>.stdin.
+        """
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\necho \"$*\" >> \"$0.calls\"\ncat > \"$0.stdin\"\n"
+                    "cat <<'EOF'\n%sEOF\nexit %i\n" % (output, returncode))
+        os.chmod(path, 0755)
+        return path
+
+    def calls(self, name):
+        """returns the argument strings of the calls of the command name"""
+        try:
+            with open(os.path.join(self.directory, name + ".calls")) as f:
+                return f.read().splitlines()
+        except IOError:
+            return []
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,31 @@
+import unittest
+
+from batch import chunkArgs
+
+class ChunkArgsTest(unittest.TestCase):
+
+    # (args, maxBytes, chunks), every argument takes its length + 1 (separator) bytes
+    cases = [
+            ([], 10, []),
+            (["1"], 10, [["1"]]),
+            (["12", "34", "56"], 9, [["12", "34", "56"]]),
+            (["12", "34", "56"], 8, [["12", "34"], ["56"]]),
+            (["12", "34", "56"], 3, [["12"], ["34"], ["56"]]),
+            # an argument longer than maxBytes gets a chunk of its own
+            (["1", "123456", "2"], 4, [["1"], ["123456"], ["2"]]),
+            ([1, 22, 333], 6, [["1", "22"], ["333"]]),
+            ]
+
+    def testCases(self):
+        for args, maxBytes, chunks in self.cases:
+            self.assertEqual(chunkArgs(args, maxBytes), chunks, (args, maxBytes))
+
+    def testChunksStayBelowTheLimit(self):
+        args = [str(1000000 + i) for i in range(20000)]
+        chunks = chunkArgs(args, 32768)
+        self.assertEqual(sum(chunks, []), args)
+        for chunk in chunks:
+            self.assertTrue(sum(len(arg) + 1 for arg in chunk) <= 32768)
+
+if __name__ == "__main__":
+    unittest.main()
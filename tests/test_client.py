@@ -0,0 +1,64 @@
+import unittest
+
+from client import OneRPC, iter_pool
+
+def vmXML(id, state=3):
+    return "<VM><ID>%i</ID><NAME>one-%i</NAME><STATE>%i</STATE><LCM_STATE>3</LCM_STATE></VM>" % (id, id, state)
+
+class FakeOned(OneRPC):
+    """OneRPC answering vmpool.info from a list of VM ids, done VMs have state 6"""
+
+    def __init__(self, ids, done=()):
+        self.auth = "user:password"
+        self.observer = None
+        self.ids = sorted(ids)
+        self.done = set(done)
+        self.calls = []
+
+    def _call(self, method, *args):
+        self.calls.append((method,) + args)
+        user, start, end, state = args
+        ids = [id for id in self.ids if id >= start and (end == -1 or id <= end)]
+        if state == -1:
+            ids = [id for id in ids if not id in self.done]
+        return (True, "<VM_POOL>%s</VM_POOL>" % "".join(vmXML(id, 6 if id in self.done else 3) for id in ids), 0)
+
+class HighestVMIDTest(unittest.TestCase):
+
+    # (VM ids, startRange, highest VM id)
+    cases = [
+            ([], 1, 0),
+            ([1], 1, 1),
+            (range(1, 2), 5, 4),
+            (range(1, 1000), 1, 999),
+            (range(1, 1025), 1, 1024),
+            (range(1, 1026), 1, 1025),
+            (range(300, 5000), 300, 4999),
+            # a purged VM ends the search early
+            (range(1, 10) + range(20, 30), 1, 9),
+            ]
+
+    def testCases(self):
+        for ids, startRange, highest in self.cases:
+            oned = FakeOned(ids)
+            self.assertEqual(oned.highestVMID(startRange), highest, (ids[:3], startRange))
+            # every probe asks for a single id
+            for method, user, start, end, state in oned.calls:
+                self.assertEqual(start, end)
+
+    def testColdStartIsPaged(self):
+        oned = FakeOned(range(1, 2503), done=range(1, 1500))
+        vms = oned.vmpoolInfoPaged("anyButDone", startRange=1, pageSize=1000, lastID=0)
+        self.assertEqual([vm.id for vm in vms], range(1500, 2503))
+        pages = [call[2:4] for call in oned.calls if call[4] == -1]
+        self.assertEqual(pages, [(1, 1000), (1001, 2000), (2001, -1)])
+        self.assertTrue(len(oned.calls) < 30)
+
+class IterPoolTest(unittest.TestCase):
+
+    def testOnlyRecordsBelowTheRoot(self):
+        xml = "<VM_POOL>%s<VM><ID>2</ID><USER_TEMPLATE><VM>x</VM></USER_TEMPLATE></VM></VM_POOL>" % vmXML(1)
+        self.assertEqual([element.find("ID").text for element in iter_pool(xml, "VM")], ["1", "2"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+
+from StringIO import StringIO
+
+from tests.fakes import FakeCommands
+from sge import SGE
+
+# qstat -xml
+qstatOutput = """\
+<?xml version='1.0'?>
+<job_info  xmlns:xsd="http://arc.liv.ac.uk/repos/darcs/sge/source/dist/util/resources/schemas/qstat/qstat.xsd">
+  <queue_info>
+    <job_list state="running">
+      <JB_job_number>41</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>one-1</JB_name>
+      <JB_owner>oneadmin</JB_owner>
+      <state>r</state>
+      <JAT_start_time>2013-09-30T10:00:00</JAT_start_time>
+      <queue_name>long.q@node1.test</queue_name>
+      <slots>1</slots>
+    </job_list>
+    <job_list state="running">
+      <JB_job_number>42</JB_job_number>
+      <JAT_prio>0.55500</JAT_prio>
+      <JB_name>one-2</JB_name>
+      <JB_owner>oneadmin</JB_owner>
+      <state>dr</state>
+      <JAT_start_time>2013-09-30T10:00:00</JAT_start_time>
+      <queue_name>long.q@node2.test</queue_name>
+      <slots>1</slots>
+    </job_list>
+  </queue_info>
+  <job_info>
+    <job_list state="pending">
+      <JB_job_number>43</JB_job_number>
+      <JAT_prio>0.00000</JAT_prio>
+      <JB_name>one-3</JB_name>
+      <JB_owner>oneadmin</JB_owner>
+      <state>qw</state>
+      <JB_submission_time>2013-09-30T10:01:00</JB_submission_time>
+      <queue_name></queue_name>
+      <slots>1</slots>
+    </job_list>
+  </job_info>
+</job_info>
+"""
+
+# qdel 42 43 44 45, exits with 1 because job 44 does not exist
+qdelOutput = """\
+oneadmin has registered the job 42 for deletion
+oneadmin has deleted job 43
+denied: job "44" does not exist
+"""
+
+class IterJobsTest(unittest.TestCase):
+
+    def testSections(self):
+        jobs = [(section, element.find("JB_job_number").text) for section, element in SGE.iterJobs(StringIO(qstatOutput))]
+        self.assertEqual(jobs, [("queue_info", "41"), ("queue_info", "42"), ("job_info", "43")])
+
+    def testEmptyQueue(self):
+        self.assertEqual(list(SGE.iterJobs(StringIO("<?xml version='1.0'?>\n<job_info>\n  <queue_info>\n  </queue_info>\n"
+                "  <job_info>\n  </job_info>\n</job_info>\n"))), [])
+
+class QdelPatternTest(unittest.TestCase):
+
+    # (qdel output line, job id or None)
+    cases = [
+            ("oneadmin has registered the job 42 for deletion", "42"),
+            ("oneadmin has deleted job 43", "43"),
+            ('denied: job "44" does not exist', "44"),
+            ('oneadmin has registered the job 4711 for deletion', "4711"),
+            ("error: unable to contact qmaster", None),
+            ("", None),
+            ]
+
+    def testCases(self):
+        for line, id in self.cases:
+            match = SGE.qdelJobPattern.search(line)
+            self.assertEqual(match.group(1) if match is not None else None, id, line)
+
+class DeleteJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = FakeCommands()
+        self.sge = SGE(qstat=self.commands.add("qstat", qstatOutput), qdel=self.commands.add("qdel", qdelOutput, 1))
+
+    def tearDown(self):
+        self.commands.cleanup()
+
+    def testJobs(self):
+        self.assertEqual([job.id for job in self.sge.getRunningJobs()], ["41"])
+        self.assertEqual([job.id for job in self.sge.getPendingJobs()], ["43"])
+        self.assertEqual(self.sge.getRunningJobs()[0].hostname, "node1.test")
+
+    def testDeleteJobs(self):
+        results = self.sge.deleteJobs(["42", "43", "44", "45"])
+        self.assertEqual(self.commands.calls("qdel"), ["42 43 44 45"])
+        self.assertEqual([(id, status) for id, status, output in results],
+                [("42", True), ("43", True), ("44", False), ("45", False)])
+        self.assertEqual(results[2][2], 'denied: job "44" does not exist')
+        self.assertEqual(results[3][2], "qdel did not report job 45")
+
+if __name__ == "__main__":
+    unittest.main()
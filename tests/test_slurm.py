@@ -0,0 +1,209 @@
+import unittest
+
+from tests.fakes import FakeCommands
+from slurm import Slurm, SlurmJob
+from registry import JobRegistry
+from scheduler import Scheduler, CycleIndex
+
+# squeue --noheader --array --states=all --format='%i|%j|%t|%N'
+squeueOutput = """\
+101|one-1|R|node1
+102|one-2|S|node2
+103|one-3|ST|
+104|one-4|PD|
+105|one-5|RH|
+106|one-6|CD|node6
+107|one-7|XX|node7
+"""
+
+# sacct --noheader --parsable2 --allocations --format=jobid,jobname,state,nodelist,end
+sacctOutput = """\
+106|one-6|COMPLETED|node6|2024-05-02T10:00:00
+108_3|one-array-10|CANCELLED by 1000|node8|2024-05-02T10:05:00
+109|one-9|FAILED|None assigned|2024-05-02T10:06:00
+110|one-11|RUNNING|node9|Unknown
+"""
+
+# sinfo --noheader --Node --format='%N|%P|%T|%C|%e'
+sinfoOutput = """\
+node1|batch*|idle|0/8/0/8|16000
+node2|batch*|mixed|4/4/0/8|8000
+node3|batch*|allocated|8/0/0/8|1000
+node4|other|idle|0/8/0/8|16000
+"""
+
+class VM(object):
+    def __init__(self, id):
+        self.id = id
+        self.name = "one-%i" % id
+
+# scancel 42 43_1 44, exits with 1 because job 43_1 is gone
+scancelOutput = """\
+scancel: error: Kill job error on job id 43_1: Invalid job id specified
+"""
+
+class SlurmJobTest(unittest.TestCase):
+
+    # (output line, (id, name, state, hostname) or None)
+    cases = [
+            ("101|one-1|R|node1", ("101", "one-1", "running", "node1.test")),
+            ("102|one-2|PD|", ("102", "one-2", "pending", "")),
+            # array tasks run the VM base + task index
+            ("103_0|one-array-20|R|node2", ("103_0", "one-20", "running", "node2.test")),
+            ("103_7|one-array-20|PD|", ("103_7", "one-27", "pending", "")),
+            # pending array tasks are listed as one record by squeue without --array
+            ("103_[8-9]|one-array-20|PD|", ("103_[8-9]", "one-array-20", "pending", "")),
+            ("104_1|other-array|R|node3", ("104_1", "other-array", "running", "node3.test")),
+            # the job name may contain the delimiter
+            ("105|a|b|R|node4", ("105", "a|b", "running", "node4.test")),
+            ("106|one-6|CANCELLED by 1000|None assigned", ("106", "one-6", "finished", "")),
+            ("107|one-7|RH|", ("107", "one-7", "pending", "")),
+            ("108|one-8|NEW_STATE|node5", ("108", "one-8", "unknown", "node5.test")),
+            ("", None),
+            ("109|one-9", None),
+            ]
+
+    def testCases(self):
+        for line, expected in self.cases:
+            job = SlurmJob.fromLine(line, ".test")
+            if expected is None:
+                self.assertEqual(job, None, line)
+            else:
+                self.assertEqual((job.id, job.name, job.state, job.hostname), expected, line)
+
+class ArraySpecTest(unittest.TestCase):
+
+    # (sorted task indices, --array value)
+    cases = [
+            ([0], "0"),
+            ([0, 1, 2, 3], "0-3"),
+            ([0, 1, 2, 3, 7], "0-3,7"),
+            ([0, 2, 4], "0,2,4"),
+            ([0, 1, 5, 6, 9], "0-1,5-6,9"),
+            ]
+
+    def testCases(self):
+        for indices, spec in self.cases:
+            self.assertEqual(Slurm._arraySpec(indices), spec)
+
+    def testArrays(self):
+        slurm = Slurm.__new__(Slurm)
+        slurm.maxArraySize = 10
+        # (sorted VM ids, (base, task indices) tuples)
+        cases = [
+                ([], []),
+                ([5], [(5, [0])]),
+                ([5, 6, 14], [(5, [0, 1, 9])]),
+                ([5, 6, 15], [(5, [0, 1]), (15, [0])]),
+                ([1, 30, 31, 45], [(1, [0]), (30, [0, 1]), (45, [0])]),
+                ]
+        for vmids, arrays in cases:
+            self.assertEqual(slurm._arrays(vmids), arrays, vmids)
+
+class SlurmStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = FakeCommands()
+        self.slurm = Slurm(squeue=self.commands.add("squeue", squeueOutput), sacct=self.commands.add("sacct"),
+                standardHostSuffix=".test")
+
+    def tearDown(self):
+        self.commands.cleanup()
+
+    def testFiling(self):
+        self.assertEqual(sorted(job.name for job in self.slurm.getRunningJobs()), ["one-1", "one-2", "one-7"])
+        self.assertEqual(sorted(job.name for job in self.slurm.getPendingJobs()), ["one-3", "one-4", "one-5"])
+        # finished jobs are listed by sacct only
+        self.assertEqual(self.slurm.getFinishedJobs(), [])
+
+    def testSuspendedJobKeepsItsVM(self):
+        vms = [VM(1), VM(2), VM(7)]
+        registry = JobRegistry()
+        scheduler = Scheduler.__new__(Scheduler)
+        scheduler.runningVMs = vms
+        scheduler.index = CycleIndex(vms, [], self.slurm.getRunningJobs(), self.slurm.getPendingJobs(), registry)
+
+        zombies = []
+        class RPC(object):
+            def vmActionBatch(self, action, ids):
+                return [None] * len(ids)
+        def rpcBatches(action, keys, batchFunction, argsList):
+            zombies.extend(keys)
+            return []
+        scheduler.rpc = RPC()
+        scheduler.rpcBatches = rpcBatches
+        scheduler.shutdownRunningZombies()
+        self.assertEqual(zombies, [])
+
+        registry.update(self.slurm.getRunningJobs() + self.slurm.getPendingJobs())
+        self.assertEqual(registry.jobID(2), "102")
+
+class SlurmFinishedJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = FakeCommands()
+        self.slurm = Slurm(squeue=self.commands.add("squeue"), sacct=self.commands.add("sacct", sacctOutput),
+                standardHostSuffix=".test")
+
+    def tearDown(self):
+        self.commands.cleanup()
+
+    def testFinishedJobs(self):
+        jobs = dict((job.id, job) for job in self.slurm.getFinishedJobs())
+        self.assertEqual(sorted(jobs), ["106", "108_3", "109"])
+        # squeue and sacct report the same hostnames
+        self.assertEqual(jobs["106"].hostname, "node6.test")
+        self.assertEqual(jobs["108_3"].hostname, "node8.test")
+        self.assertEqual(jobs["108_3"].name, "one-13")
+        self.assertEqual(jobs["109"].hostname, "")
+
+class SlurmSubmitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = FakeCommands()
+        self.slurm = Slurm(squeue=self.commands.add("squeue"), sacct=self.commands.add("sacct"),
+                sinfo=self.commands.add("sinfo", sinfoOutput), sbatch=self.commands.add("sbatch", "42\n"),
+                standardQueue="batch", standardHostSuffix=".test")
+
+    def tearDown(self):
+        self.commands.cleanup()
+
+    def testSubmitsUseTheCycleSnapshot(self):
+        # the snapshot of the cycle (Scheduler.fetchHosts)
+        self.slurm.getQueueHostSnapshot()
+        hosts = set(["node1.test", "node2.test"])
+        results = self.slurm.submitJobs(["one-10", "one-11", "one-13"], hosts=hosts, memory="512", cpu="1")
+        self.slurm.submitJob("one-20", hosts=hosts)
+        self.assertEqual(len(self.commands.calls("sinfo")), 1)
+
+        self.assertEqual(results, [("one-10", True, "42_0"), ("one-11", True, "42_1"), ("one-13", True, "42_3")])
+        calls = self.commands.calls("sbatch")
+        self.assertEqual(len(calls), 2)
+        self.assertTrue("--job-name=one-array-10 --array=0-1,3 " in calls[0])
+        self.assertTrue("--exclude=node3" in calls[0])
+        self.assertFalse("node4" in calls[0])
+
+class SlurmDeleteJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = FakeCommands()
+        self.slurm = Slurm(squeue=self.commands.add("squeue"), sacct=self.commands.add("sacct"),
+                scancel=self.commands.add("scancel", scancelOutput, 1))
+
+    def tearDown(self):
+        self.commands.cleanup()
+
+    def testDeleteJobs(self):
+        results = self.slurm.deleteJobs(["42", "43_1", "44"])
+        self.assertEqual(self.commands.calls("scancel"), ["42 43_1 44"])
+        self.assertEqual(results, [("42", True, "42"),
+                ("43_1", False, "scancel: error: Kill job error on job id 43_1: Invalid job id specified"),
+                ("44", True, "44")])
+
+    def testUnparsableError(self):
+        self.commands.add("scancel", "scancel: error: slurm_receive_msg: Socket timed out\n", 1)
+        results = self.slurm.deleteJobs(["42", "43"])
+        self.assertEqual([status for id, status, output in results], [False, False])
+
+if __name__ == "__main__":
+    unittest.main()